@@ -0,0 +1,57 @@
+"""Time of a checkpoint save vs. a training epoch, and the overhead of saving after every epoch or on an interval.
+
+Run from the repository root, with --dir on the disk the checkpoints go to (e.g. the mounted Google Drive):
+    python -m benchmarks.bench_checkpoint --widths 2 26 100 900 --dir /content/drive/MyDrive/checkpoint_bench
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+from double_descent.checkpoint import CheckpointStore
+from double_descent.models import get_batches, train_epoch
+from benchmarks.bench_epoch import synthetic_data, time_epochs
+
+# Mean time of one save of a width's checkpoint (torch.save to a temporary file and the rename), in milliseconds
+def time_saves(n_hidden, model, root, n_saves, n_epoch=1000):
+  optimizer = torch.optim.SGD(model.parameters(), lr = 0.01, momentum=0.9)
+  # One step fills the momentum buffers, which the checkpoint holds as well
+  loss_function = torch.nn.CrossEntropyLoss()
+  train_epoch(model, optimizer, loss_function, get_batches(torch.randn(100, 40), torch.randint(0, 10, (100,)), batch_size=100, loader='tensor'))
+  checkpoint = CheckpointStore(root, {}, None).width(n_hidden, 0, n_epoch=n_epoch)
+  checkpoint.resume(model, optimizer, n_epoch)
+  times = []
+  for save in range(n_saves):
+    start = time.perf_counter()
+    checkpoint._save(save + 1, model, optimizer, done=False)
+    times.append(1000 * (time.perf_counter() - start))
+  return np.mean(times), os.path.getsize(checkpoint.path) / 1e6
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--widths', type=int, nargs='+', default=[2, 26, 100, 900])
+  parser.add_argument('--epochs', type=int, default=20)
+  parser.add_argument('--saves', type=int, default=20)
+  parser.add_argument('--interval', type=float, default=60.0, help='seconds between saves of CheckpointStore(interval=...)')
+  parser.add_argument('--dir', default=None, help='directory to save to (a temporary directory by default)')
+  args = parser.parse_args()
+
+  root = tempfile.mkdtemp(dir=args.dir)
+  data = synthetic_data()
+  print(f'{"width":>6} {"MB":>6} {"save ms":>8} {"epoch ms":>9} {"every=1":>8} {f"interval={args.interval:g}s":>13}')
+  try:
+    for n_hidden in args.widths:
+      epoch_ms, std, model = time_epochs(n_hidden, data, 'tensor', args.epochs)
+      save_ms, size = time_saves(n_hidden, model, root, args.saves)
+      # Overhead relative to training: one save per epoch, or at most one save per interval
+      print(f'{n_hidden:6d} {size:6.2f} {save_ms:8.2f} {epoch_ms:9.2f} {save_ms / epoch_ms:7.1%} {save_ms / (1000 * args.interval):13.3%}')
+  finally:
+    shutil.rmtree(root)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,100 @@
+"""Training throughput of the eager, torch.compile and bfloat16 training steps of fit_model.
+
+Reports samples per second for each width and step (on synthetic data of the
+MNIST-1D shapes), then trains every width on the notebooks' MNIST-1D split
+(8000 samples, 15% label noise, from the dataset cache) with fit_model for
+--check-epochs epochs (the full 1000 by default) with each step from the same
+seed, and checks that the final train/test errors stay within --tolerance
+percentage points of eager.
+
+Run from the repository root:
+    python -m benchmarks.bench_compile --widths 2 26 100 900 --epochs 20
+    python -m benchmarks.bench_compile --check-epochs 200    # shorter error check
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from double_descent.models import get_model, get_tensors, get_batches, train_epoch, make_train_step, bf16_supported, fit_model
+from double_descent.evaluation import Evaluation
+from double_descent.data import load_dataset
+from benchmarks.bench_epoch import synthetic_data
+
+STEPS = {'eager': {}, 'compile': {'compile': True}, 'bf16': {'bf16': True}, 'compile+bf16': {'compile': True, 'bf16': True}}
+
+# A fresh model from the same seed with its optimizer, batches and training step
+def setup(n_hidden, data, step_kwargs, seed=0):
+  torch.manual_seed(seed)
+  model = get_model(n_hidden)
+  loss_function = torch.nn.CrossEntropyLoss()
+  optimizer = torch.optim.SGD(model.parameters(), lr = 0.01, momentum=0.9)
+  x_train, y_train, x_test, y_test = get_tensors(data)
+  batches = get_batches(x_train, y_train, batch_size=100, loader='tensor')
+  step = make_train_step(model, optimizer, loss_function, **step_kwargs) if step_kwargs else None
+  return model, optimizer, loss_function, batches, step
+
+# Samples per second of training epochs after one warm-up epoch (which also compiles)
+def throughput(n_hidden, data, step_kwargs, n_epoch):
+  model, optimizer, loss_function, batches, step = setup(n_hidden, data, step_kwargs)
+  train_epoch(model, optimizer, loss_function, batches, step)
+  start = time.perf_counter()
+  for epoch in range(n_epoch):
+    train_epoch(model, optimizer, loss_function, batches, step)
+  return n_epoch * len(data['y']) / (time.perf_counter() - start)
+
+# The MNIST-1D split of the notebooks, with their 15% label noise
+def mnist1d_data(cache_dir):
+  import mnist1d.data
+  args = mnist1d.data.get_dataset_args()
+  args.num_samples = 8000
+  args.train_split = 0.5
+  args.corr_noise_scale = 0.25
+  args.iid_noise_scale = 2e-2
+  return load_dataset(args, cache_dir, noise_rate=0.15)
+
+# Train and test error of fit_model after n_epoch epochs, evaluated only at the end
+def final_errors(n_hidden, data, step_kwargs, n_epoch, seed=0):
+  torch.manual_seed(seed)
+  errors_train, errors_test, pred_train, pred_test = fit_model(get_model(n_hidden), data, loader='tensor', evaluation=Evaluation(epochs=[]),
+                                                               n_epoch=n_epoch, **step_kwargs)
+  return float(errors_train), float(errors_test)
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--widths', type=int, nargs='+', default=[2, 26, 100, 900])
+  parser.add_argument('--epochs', type=int, default=20)
+  parser.add_argument('--check-epochs', type=int, default=1000, help='epochs of the error check on MNIST-1D')
+  parser.add_argument('--cache-dir', default='./mnist1d_cache', help='MNIST-1D dataset cache (see data.get_dataset_cached)')
+  parser.add_argument('--tolerance', type=float, default=2.0, help='allowed error difference to eager, in percentage points')
+  parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+  args = parser.parse_args()
+  if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+  steps = {name: kwargs for name, kwargs in STEPS.items() if bf16_supported() or not kwargs.get('bf16')}
+  if len(steps) < len(STEPS):
+    print('This CPU has no native bfloat16 support, skipping the bf16 steps')
+  data = synthetic_data()
+
+  print('samples/sec')
+  print(f'{"width":>6} ' + ' '.join(f'{name:>13}' for name in steps))
+  for n_hidden in args.widths:
+    rates = [throughput(n_hidden, data, kwargs, args.epochs) for kwargs in steps.values()]
+    print(f'{n_hidden:6d} ' + ' '.join(f'{rate:13.0f}' for rate in rates))
+
+  data = mnist1d_data(args.cache_dir)
+  print(f'\nfinal MNIST-1D train/test error after {args.check_epochs} epochs')
+  print(f'{"width":>6} ' + ' '.join(f'{name:>13}' for name in steps) + f' {"within tol":>10}')
+  all_within = True
+  for n_hidden in args.widths:
+    errors = np.array([final_errors(n_hidden, data, kwargs, args.check_epochs) for kwargs in steps.values()])
+    within = bool(np.all(np.abs(errors - errors[0]) <= args.tolerance))
+    all_within &= within
+    print(f'{n_hidden:6d} ' + ' '.join(f'{train:6.2f}/{test:6.2f}' for train, test in errors) + f' {str(within):>10}')
+  print(f'\nAll error curves within {args.tolerance} points of eager: {all_within}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,58 @@
+"""Per-epoch training time of the DataLoader path vs. the TensorBatches fast path of fit_model.
+
+Run from the repository root:
+    python -m benchmarks.bench_epoch --widths 2 26 100 900 --epochs 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from double_descent.models import get_model, get_batches, train_epoch
+
+# Random data with the shapes of the MNIST-1D split used by the notebooks (4000 x 40, 10 classes)
+def synthetic_data(n_train=4000, n_test=4000, seed=0):
+  rng = np.random.default_rng(seed)
+  return {'x': rng.standard_normal((n_train, 40)), 'y': rng.integers(0, 10, n_train),
+          'x_test': rng.standard_normal((n_test, 40)), 'y_test': rng.integers(0, 10, n_test)}
+
+# Mean and standard deviation of the time of one training epoch, in milliseconds
+def time_epochs(n_hidden, data, loader, n_epoch, seed=0):
+  torch.manual_seed(seed)
+  model = get_model(n_hidden)
+  loss_function = torch.nn.CrossEntropyLoss()
+  optimizer = torch.optim.SGD(model.parameters(), lr = 0.01, momentum=0.9)
+  x_train = torch.tensor(data['x'].astype('float32'))
+  y_train = torch.tensor(data['y'].astype('long'))
+  batches = get_batches(x_train, y_train, batch_size=100, loader=loader)
+  # one warm-up epoch
+  train_epoch(model, optimizer, loss_function, batches)
+  times = []
+  for epoch in range(n_epoch):
+    start = time.perf_counter()
+    train_epoch(model, optimizer, loss_function, batches)
+    times.append(1000 * (time.perf_counter() - start))
+  return np.mean(times), np.std(times), model
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--widths', type=int, nargs='+', default=[2, 26, 100, 900])
+  parser.add_argument('--epochs', type=int, default=20)
+  parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+  args = parser.parse_args()
+  if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+  data = synthetic_data()
+  print(f'{"width":>6} {"dataloader ms":>14} {"tensor ms":>14} {"speedup":>8} {"same weights":>13}')
+  for n_hidden in args.widths:
+    mean_dl, std_dl, model_dl = time_epochs(n_hidden, data, 'dataloader', args.epochs)
+    mean_t, std_t, model_t = time_epochs(n_hidden, data, 'tensor', args.epochs)
+    # With the same seed both paths see the same batches, so they end with the same weights
+    same = all(torch.equal(p_dl, p_t) for p_dl, p_t in zip(model_dl.parameters(), model_t.parameters()))
+    print(f'{n_hidden:6d} {mean_dl:8.2f}±{std_dl:5.2f} {mean_t:8.2f}±{std_t:5.2f} {mean_dl / mean_t:7.2f}x {str(same):>13}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,167 @@
+"""Benchmark suite: training, evaluation, attribution and rendering per width.
+
+Times, for each width (2, 26, 100 and 900 by default):
+    train_epoch_dataloader  one fit_model epoch with the DataLoader
+    train_epoch_tensor      one fit_model epoch with TensorBatches
+    evaluation              the full-split evaluation of the last epoch
+    shap_100                DeepLIFT/SHAP values of 100 samples (ShapEngine)
+    deepexplainer_100       the notebooks' shap.DeepExplainer(model, x_train), full training background
+                            (recorded as skipped when shap isn't installed or with --skip-deepexplainer)
+    lime_100                LIME explanations of 100 samples (BatchedLimeExplainer)
+    saliency_100            saliency maps of 100 samples
+    render_100              100 attribution scatter plots encoded as 300-dpi JPEGs
+
+and the cold-start time of the command-line runner (python -m double_descent)
+
+and writes the median, mean, standard deviation and minimum of --repeats runs
+of each as JSON, together with the CPU, thread and library versions, so
+results of different commits and machines can be compared.
+
+Run from the repository root:
+    python -m benchmarks.bench_suite --output bench_suite.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+import torch
+
+from double_descent.models import get_model, get_tensors, get_batches, train_epoch
+from double_descent.evaluation import Evaluation
+from double_descent.attribution import ShapEngine
+from double_descent.batched_lime import BatchedLimeExplainer
+from double_descent.saliency import saliency_maps
+from benchmarks.bench_epoch import synthetic_data
+
+def cpu_model():
+  try:
+    with open('/proc/cpuinfo') as f:
+      for line in f:
+        if line.startswith('model name'):
+          return line.split(':', 1)[1].strip()
+  except OSError:
+    pass
+  return platform.processor()
+
+def git_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+# Machine, thread and library settings the timings depend on
+def metadata():
+  return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'host': socket.gethostname(), 'commit': git_commit(),
+          'platform': platform.platform(), 'python': sys.version.split()[0], 'cpu': cpu_model(), 'cpu_count': os.cpu_count(),
+          'torch': torch.__version__, 'numpy': np.__version__, 'torch_threads': torch.get_num_threads(),
+          'torch_interop_threads': torch.get_num_interop_threads(), 'mkldnn': torch.backends.mkldnn.is_available(),
+          'omp_num_threads': os.environ.get('OMP_NUM_THREADS'), 'parallel_info': torch.__config__.parallel_info()}
+
+# Seconds of repeats calls of function (after warmup calls), summarized
+def timed(function, repeats, warmup=1):
+  for _ in range(warmup):
+    function()
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - start)
+  return {'median': float(np.median(times)), 'mean': float(np.mean(times)), 'std': float(np.std(times)),
+          'min': float(np.min(times)), 'repeats': repeats}
+
+# Wall time of fresh interpreters running the command-line runner, against importing the training code
+def bench_cold_start(repeats):
+  commands = {'cli_help': ['-m', 'double_descent', '--help'], 'cli_train_help': ['-m', 'double_descent', 'train', '--help'],
+              'import_models': ['-c', 'import double_descent.models']}
+  return {name: timed(lambda: subprocess.run([sys.executable] + command, capture_output=True, check=True), repeats)
+          for name, command in commands.items()}
+
+def bench_width(n_hidden, data, x_train, y_train, x_test, y_test, engine, lime, template, shap, args):
+  torch.manual_seed(0)
+  model = get_model(n_hidden)
+  loss_function = torch.nn.CrossEntropyLoss()
+  optimizer = torch.optim.SGD(model.parameters(), lr = 0.01, momentum=0.9)
+  x_explain = x_test[:100]
+  results = {}
+
+  for loader in ('dataloader', 'tensor'):
+    batches = get_batches(x_train, y_train, batch_size=100, loader=loader)
+    results[f'train_epoch_{loader}'] = timed(lambda: train_epoch(model, optimizer, loss_function, batches), args.repeats)
+
+  evaluation = Evaluation()
+  evaluation.start(model, x_train, y_train, x_test, y_test, 1)
+  results['evaluation'] = timed(lambda: evaluation.evaluate(0, loss_function), args.repeats)
+
+  results['shap_100'] = timed(lambda: engine.shap_values(model, x_explain), args.repeats)
+  if args.skip_deepexplainer:
+    results['deepexplainer_100'] = {'skipped': '--skip-deepexplainer'}
+  elif shap is None:
+    results['deepexplainer_100'] = {'skipped': 'shap is not installed'}
+  else:
+    def deep_explainer():
+      explainer = shap.DeepExplainer(model, x_train)
+      explainer.shap_values(x_explain)
+    results['deepexplainer_100'] = timed(deep_explainer, max(1, args.repeats // 5))
+  results['lime_100'] = timed(lambda: lime.explain(model, x_explain.numpy(), num_samples=args.lime_samples), args.repeats)
+  results['saliency_100'] = timed(lambda: saliency_maps(model, x_explain), args.repeats)
+
+  from double_descent.render import draw
+  values = saliency_maps(model, x_explain)[np.arange(len(x_explain)), :, 0]
+  def render():
+    for sample in range(len(x_explain)):
+      draw(template, x_explain[sample].numpy(), data['t'], values[sample]).savefig(io.BytesIO(), format='jpg', dpi=300)
+  results['render_100'] = timed(render, max(1, args.repeats // 5))
+  return results
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--widths', type=int, nargs='+', default=[2, 26, 100, 900])
+  parser.add_argument('--repeats', type=int, default=5)
+  parser.add_argument('--lime-samples', type=int, default=5000, help='perturbations per LIME explanation')
+  parser.add_argument('--skip-deepexplainer', action='store_true', help="don't time shap.DeepExplainer (slow at large widths)")
+  parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+  parser.add_argument('--output', default=None, help='JSON file to write (printed when not given)')
+  args = parser.parse_args()
+  if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+  import matplotlib
+  matplotlib.use('Agg')
+  from double_descent.render import new_template
+
+  data = synthetic_data()
+  data['t'] = np.linspace(-1, 1, 40, dtype=np.float32)
+  x_train, y_train, x_test, y_test = get_tensors(data)
+  engine = ShapEngine(x_train, y_train, method='kmeans', size=100)
+  lime = BatchedLimeExplainer(x_train.numpy())
+  template = new_template()
+  try:
+    import shap
+  except ImportError:
+    shap = None
+
+  results = {'metadata': metadata(), 'settings': vars(args), 'cold_start': bench_cold_start(args.repeats), 'widths': {}}
+  print(' '.join(f'{name} {timing["median"] * 1000:.0f}ms' for name, timing in results['cold_start'].items()), file=sys.stderr)
+  for n_hidden in args.widths:
+    results['widths'][str(n_hidden)] = bench_width(n_hidden, data, x_train, y_train, x_test, y_test, engine, lime, template, shap, args)
+    print(f'{n_hidden:4d} ' + ' '.join(f'{stage} {timing["median"] * 1000:.1f}ms' if 'median' in timing else f'{stage} skipped'
+                                       for stage, timing in results['widths'][str(n_hidden)].items()),
+          file=sys.stderr)
+
+  output = json.dumps(results, indent=1)
+  if args.output is None:
+    print(output)
+  else:
+    with open(args.output, 'w') as f:
+      f.write(output)
+
+if __name__ == '__main__':
+  main()
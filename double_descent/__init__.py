@@ -0,0 +1,6 @@
+"""Shared training and analysis code for the MNIST-1D interpretable double descent notebooks.
+
+The notebooks in the repository root keep their Colab cells; the functions they
+have in common (model construction, training and the width sweep) live here so
+the sweep can be run and extended outside of Colab.
+"""
@@ -0,0 +1,221 @@
+"""Batched attributions for the get_model MLP: DeepLIFT/SHAP with a cached background, and closed-form paths.
+
+shap.DeepExplainer(model, x_train) averages DeepLIFT (rescale rule) attributions
+over every background row, for every width and explained sample. Here the
+background is summarized once per dataset (k-means centers weighted by cluster
+size, or a class-stratified subsample) and the same summary is reused for all
+widths, and the attributions of the Linear-ReLU-Linear-ReLU-Linear stack are
+computed for all 10 classes at once in large vectorized batches:
+
+    phi[b, i, c] = sum_r w_r * M[b, r, c, i] * (x[b, i] - r[r, i])
+
+where M are the DeepLIFT multipliers obtained by propagating W3 back through the
+rescaled ReLUs and the Linear layers. This is the quantity DeepExplainer
+computes for this architecture, with the same 1e-6 fallback to the plain
+gradient where a ReLU input doesn't change.
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import torch, torch.nn as nn
+
+from . import profiler
+
+# Weights and biases of the Linear layers of a get_model network, in order
+def mlp_layers(model):
+  layers = [module for module in model if isinstance(module, nn.Linear)]
+  if len(layers) != 3 or not all(isinstance(module, (nn.Linear, nn.ReLU)) for module in model):
+    raise ValueError('expected the Linear-ReLU-Linear-ReLU-Linear network built by get_model')
+  return [(layer.weight.detach(), layer.bias.detach()) for layer in layers]
+
+# Background summaries: (references [n_ref, 40], weights [n_ref] summing to one)
+
+def kmeans_background(x, size=100, n_iter=50, seed=0):
+  generator = torch.Generator().manual_seed(seed)
+  centers = x[torch.randperm(len(x), generator=generator)[:size]].clone()
+  for it in range(n_iter):
+    assignment = torch.cdist(x, centers).argmin(1)
+    counts = torch.bincount(assignment, minlength=len(centers)).float()
+    sums = torch.zeros_like(centers).index_add_(0, assignment, x)
+    # Empty clusters keep their previous center
+    filled = counts > 0
+    centers[filled] = sums[filled] / counts[filled, None]
+  counts = torch.bincount(torch.cdist(x, centers).argmin(1), minlength=len(centers)).float()
+  return centers[counts > 0], counts[counts > 0] / len(x)
+
+def stratified_background(x, y, size=100, seed=0):
+  generator = torch.Generator().manual_seed(seed)
+  index = []
+  for c in torch.unique(y):
+    members = torch.nonzero(y == c).flatten()
+    n_c = max(1, round(size * len(members) / len(y)))
+    index.append(members[torch.randperm(len(members), generator=generator)[:n_c]])
+  index = torch.cat(index)
+  return x[index], torch.full((len(index),), 1 / len(index))
+
+def full_background(x):
+  return x, torch.full((len(x),), 1 / len(x))
+
+# DeepLIFT rescale multipliers of a ReLU for every (sample, reference) pair: [n, n_ref, width]
+def rescale_multipliers(z_x, z_r):
+  delta_in = z_x[:, None, :] - z_r[None, :, :]
+  delta_out = torch.relu(z_x)[:, None, :] - torch.relu(z_r)[None, :, :]
+  gradient = (z_x > 0).to(z_x.dtype)[:, None, :].expand_as(delta_in)
+  return torch.where(delta_in.abs() < 1e-6, gradient, delta_out / delta_in)
+
+# DeepLIFT/SHAP attributions of every class for a batch of inputs, averaged over the weighted references
+# Returns [n, 40, n_classes], laid out like shap_values[j][i][k] in the notebooks
+def deeplift_shap(layers, x, references, weights):
+  (w1, b1), (w2, b2), (w3, b3) = layers
+  z1_x, z1_r = x @ w1.t() + b1, references @ w1.t() + b1
+  z2_x, z2_r = torch.relu(z1_x) @ w2.t() + b2, torch.relu(z1_r) @ w2.t() + b2
+  m1 = rescale_multipliers(z1_x, z1_r)
+  m2 = rescale_multipliers(z2_x, z2_r)
+  # Propagate the output weights back through the rescaled ReLUs: [n, n_ref, n_classes, width] -> [n, n_ref, n_classes, 40]
+  g = (m2[:, :, None, :] * w3) @ w2
+  g = (g * m1[:, :, None, :]) @ w1
+  return torch.einsum('brci,r,bri->bic', g, weights, x[:, None, :] - references[None, :, :])
+
+# Number of elements of the [n_ref, n_classes, width] multipliers one sample needs
+def multiplier_elements(layers, n_ref=1):
+  (w1, _), _, (w3, _) = layers
+  return n_ref * w3.shape[0] * max(w1.shape)
+
+# Apply an attribution function to x in chunks whose intermediate tensors stay below max_elements
+def batched(function, x, per_sample_elements, max_elements=2**25):
+  chunk = max(1, max_elements // per_sample_elements)
+  with torch.no_grad():
+    return torch.cat([function(x[start:start + chunk]) for start in range(0, len(x), chunk)])
+
+class ShapEngine:
+  # The background summary is computed once for the dataset and reused for every model it explains
+  # With a cache_dir it is also stored on disk, keyed by the training data and the summary settings,
+  # so reruns and parallel sweep workers share it
+  def __init__(self, x_train, y_train, method='kmeans', size=100, seed=0, cache_dir=None, max_elements=2**25):
+    self.x_train = x_train
+    self.max_elements = max_elements
+    path = None
+    if cache_dir is not None:
+      digest = hashlib.sha1(x_train.numpy().tobytes() + y_train.numpy().tobytes()).hexdigest()[:16]
+      path = os.path.join(cache_dir, f'background_{method}_{size}_{seed}_{digest}.npz')
+    if path is not None and os.path.exists(path):
+      cached = np.load(path)
+      self.references, self.weights = torch.from_numpy(cached['references']), torch.from_numpy(cached['weights'])
+    else:
+      with profiler.span('shap_background'):
+        if method == 'kmeans':
+          self.references, self.weights = kmeans_background(x_train, size, seed=seed)
+        elif method == 'stratified':
+          self.references, self.weights = stratified_background(x_train, y_train, size, seed)
+        elif method == 'full':
+          self.references, self.weights = full_background(x_train)
+        else:
+          raise ValueError(f'Unknown background method {method!r}, expected "kmeans", "stratified" or "full"')
+      if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(path, references=self.references.numpy(), weights=self.weights.numpy())
+
+  # Model output averaged over the background, the base value the attributions of each class add up from
+  def expected_value(self, model, references=None, weights=None):
+    references = self.references if references is None else references
+    weights = self.weights if weights is None else weights
+    with torch.no_grad():
+      return weights @ model(references)
+
+  # SHAP values of model for every row of x, [n, 40, n_classes]
+  def shap_values(self, model, x, references=None, weights=None):
+    references = self.references if references is None else references
+    weights = self.weights if weights is None else weights
+    layers = mlp_layers(model)
+    with profiler.span('shap'):
+      return batched(lambda x_chunk: deeplift_shap(layers, x_chunk, references, weights), x,
+                     multiplier_elements(layers, len(references)), self.max_elements)
+
+  # How far the summary is from the full training background on the samples x:
+  # the error of the summarized attributions against the full-background ones, and how well
+  # the summarized attributions add up to model(x) - expected_value (as DeepExplainer checks)
+  def convergence_error(self, model, x):
+    values = self.shap_values(model, x)
+    references, weights = full_background(self.x_train)
+    values_full = self.shap_values(model, x, references, weights)
+    with torch.no_grad():
+      additivity = model(x) - self.expected_value(model)
+    return {'max_abs_error': float((values - values_full).abs().max()),
+            'relative_error': float((values - values_full).abs().sum() / values_full.abs().sum()),
+            'additivity_error': float((values.sum(1) - additivity).abs().max())}
+
+# Closed-form attributions for the get_model MLP
+# The network is linear wherever its ReLU activation masks are fixed, so the input gradient of every class
+# is W1^T diag(mask1) W2^T diag(mask2) W3^T: a few matrix products, no autograd and no explainer machinery.
+# All functions take a trained get_model network and a batch of inputs [n, 40] and return [n, 40, n_classes].
+
+# Activation masks of both hidden layers
+def relu_masks(layers, x):
+  (w1, b1), (w2, b2), _ = layers
+  z1 = x @ w1.t() + b1
+  z2 = torch.relu(z1) @ w2.t() + b2
+  return (z1 > 0).to(x.dtype), (z2 > 0).to(x.dtype)
+
+# Input gradient of every class given the activation masks
+def masked_jacobian(layers, mask1, mask2):
+  (w1, _), (w2, _), (w3, _) = layers
+  g = (mask2[:, None, :] * w3) @ w2
+  return ((g * mask1[:, None, :]) @ w1).transpose(1, 2)
+
+def gradients(model, x, max_elements=2**25):
+  layers = mlp_layers(model)
+  return batched(lambda x_chunk: masked_jacobian(layers, *relu_masks(layers, x_chunk)), x,
+                 multiplier_elements(layers), max_elements)
+
+def gradient_x_input(model, x, max_elements=2**25):
+  return gradients(model, x, max_elements) * x[:, :, None]
+
+# DeepLIFT (rescale rule) against a single baseline, zero by default
+def deeplift(model, x, baseline=None, max_elements=2**25):
+  layers = mlp_layers(model)
+  references = torch.zeros(1, x.shape[1]) if baseline is None else baseline.reshape(1, -1)
+  return batched(lambda x_chunk: deeplift_shap(layers, x_chunk, references, torch.ones(1)), x,
+                 multiplier_elements(layers), max_elements)
+
+# Integrated gradients from the zero baseline
+# Along the path alpha * x the gradient is piecewise constant, changing where a ReLU switches. Locating every
+# switch exactly takes up to width^2 crossing points per sample, so the path integral is a midpoint sum of the
+# closed-form gradients over `steps` points instead; its completeness gap shows in validate_attributions.
+def integrated_gradients(model, x, steps=64, max_elements=2**25):
+  layers = mlp_layers(model)
+  alphas = (torch.arange(steps, dtype=x.dtype) + 0.5) / steps
+
+  def path_integral(x_chunk):
+    path = (alphas[:, None, None] * x_chunk[None]).reshape(-1, x_chunk.shape[1])
+    jacobian = masked_jacobian(layers, *relu_masks(layers, path))
+    return jacobian.reshape(steps, len(x_chunk), *jacobian.shape[1:]).mean(0) * x_chunk[:, :, None]
+
+  return batched(path_integral, x, steps * multiplier_elements(layers), max_elements)
+
+# Check the closed-form attributions against autograd saliency and, if shap is installed, against
+# shap.DeepExplainer with a zero background. Returns the maximum absolute differences.
+def validate_attributions(model, x):
+  report = {}
+  x_grad = x.clone().requires_grad_(True)
+  output = model(x_grad)
+  autograd = torch.stack([torch.autograd.grad(output[:, c].sum(), x_grad, retain_graph=True)[0]
+                          for c in range(output.shape[1])], -1)
+  report['gradients_vs_autograd'] = float((gradients(model, x) - autograd).abs().max())
+
+  with torch.no_grad():
+    baseline_output = model(torch.zeros(1, x.shape[1]))
+    completeness = model(x) - baseline_output
+  report['deeplift_completeness'] = float((deeplift(model, x).sum(1) - completeness).abs().max())
+  report['integrated_gradients_completeness'] = float((integrated_gradients(model, x).sum(1) - completeness).abs().max())
+
+  try:
+    import shap
+  except ImportError:
+    return report
+  shap_values = shap.DeepExplainer(model, torch.zeros(1, x.shape[1])).shap_values(x)
+  # Older shap versions return one [n, 40] array per class
+  shap_values = np.stack(shap_values, -1) if isinstance(shap_values, list) else np.asarray(shap_values)
+  report['deeplift_vs_shap'] = float(np.abs(deeplift(model, x).numpy() - shap_values).max())
+  return report
@@ -0,0 +1,287 @@
+"""Batched LIME for the 40-feature MNIST-1D signals.
+
+Mirrors lime_tabular.LimeTabularExplainer(training_data, mode='classification')
+with its defaults (quartile discretization, exponential kernel of width
+0.75 * sqrt(40), Ridge(alpha=1) surrogate) as used by the LIME notebook with
+num_features=40 and top_labels=10. With all 40 features kept, LIME's feature
+selection keeps every feature and the explanation of each label is one weighted
+ridge regression on the binary "same quartile as the instance" design.
+
+Instead of one explain_instance call per sample, the perturbations of many
+instances are drawn at once, all of them go through the model in one batched
+forward pass, and the ridge regressions of every instance and class are solved
+together with batched linear algebra.
+
+With seed_compatible=True the perturbations are drawn from a RandomState in
+exactly the order LimeTabularExplainer draws them, so explaining instances in
+order reproduces successive explain_instance calls of an explainer created with
+the same random_state. Otherwise they come from a numpy Generator, vectorized
+over instances.
+"""
+
+import os
+import json
+import hashlib
+import collections
+
+import numpy as np
+import scipy.special
+import scipy.stats
+import torch, torch.nn as nn
+
+from . import profiler
+
+class BatchedLimeExplainer:
+  def __init__(self, training_data, feature_names=None, kernel_width=None, random_state=42, seed_compatible=True):
+    n_features = training_data.shape[1]
+    self.feature_names = feature_names if feature_names is not None else ['Feature {}'.format(i) for i in range(n_features)]
+    self.kernel_width = kernel_width if kernel_width is not None else np.sqrt(n_features) * .75
+    self.seed = random_state
+    self.seed_compatible = seed_compatible
+    self.random_state = np.random.RandomState(random_state) if seed_compatible else np.random.default_rng(random_state)
+
+    # Quartile discretizer, computed the way lime's QuartileDiscretizer does
+    self.bins, self.names, self.means, self.stds, self.mins, self.maxs = [], [], [], [], [], []
+    for feature in range(n_features):
+      qts = np.array(np.percentile(training_data[:, feature], [25, 50, 75]))
+      name = self.feature_names[feature]
+      n_bins = qts.shape[0]
+      self.bins.append(qts)
+      self.names.append(['%s <= %.2f' % (name, qts[0])] +
+                        ['%.2f < %s <= %.2f' % (qts[i], name, qts[i + 1]) for i in range(n_bins - 1)] +
+                        ['%s > %.2f' % (name, qts[n_bins - 1])])
+      discretized = np.searchsorted(qts, training_data[:, feature])
+      means, stds = [], []
+      for x in range(n_bins + 1):
+        selection = training_data[discretized == x, feature]
+        means.append(0 if len(selection) == 0 else np.mean(selection))
+        stds.append((0 if len(selection) == 0 else np.std(selection)) + 0.00000000001)
+      self.means.append(np.array(means))
+      self.stds.append(np.array(stds))
+      self.mins.append(np.array([np.min(training_data[:, feature])] + qts.tolist()))
+      self.maxs.append(np.array(qts.tolist() + [np.max(training_data[:, feature])]))
+
+    # Distribution of the quartile indices in the training data, the categorical distribution LIME samples from
+    self.feature_values, self.feature_frequencies = [], []
+    discretized_training_data = self.discretize(training_data)
+    for feature in range(n_features):
+      values, frequencies = map(list, zip(*sorted(collections.Counter(discretized_training_data[:, feature]).items())))
+      self.feature_values.append(np.array(values))
+      self.feature_frequencies.append(np.array(frequencies) / float(sum(frequencies)))
+
+  # Quartile index of every feature, [n, n_features]
+  def discretize(self, x):
+    return np.stack([np.searchsorted(qts, x[:, feature]) for feature, qts in enumerate(self.bins)], 1)
+
+  # Quartile indices [n_instances, num_samples, n_features] and their continuous values sampled within the quartiles
+  def sample(self, n_instances, num_samples):
+    if self.seed_compatible:
+      samples = [self._sample_lime_order(num_samples) for instance in range(n_instances)]
+      return np.stack([bins for bins, inverse in samples]), np.stack([inverse for bins, inverse in samples])
+    return self._sample_vectorized(n_instances, num_samples)
+
+  # One instance's perturbations, consuming the RandomState in the order of LimeTabularExplainer.__data_inverse
+  def _sample_lime_order(self, num_samples):
+    n_features = len(self.bins)
+    bins = np.zeros((num_samples, n_features), dtype=np.int64)
+    for feature in range(n_features):
+      bins[:, feature] = self.random_state.choice(self.feature_values[feature], size=num_samples, replace=True,
+                                                  p=self.feature_frequencies[feature])
+    # Row 0 is the instance itself, filled in by the caller
+    inverse = np.zeros((num_samples, n_features))
+    for feature in range(n_features):
+      values = bins[1:, feature]
+      means, stds = self.means[feature][values], self.stds[feature][values]
+      minz = (self.mins[feature][values] - means) / stds
+      maxz = (self.maxs[feature][values] - means) / stds
+      ret = minz
+      unequal = minz != maxz
+      ret[unequal] = scipy.stats.truncnorm.rvs(minz[unequal], maxz[unequal], loc=means[unequal], scale=stds[unequal],
+                                               random_state=self.random_state)
+      inverse[1:, feature] = ret
+    return bins, inverse
+
+  # Perturbations of all instances at once: categorical draws by inverse CDF, truncated normals by inverse CDF
+  def _sample_vectorized(self, n_instances, num_samples):
+    n_features = len(self.bins)
+    uniform = self.random_state.random((2, n_instances, num_samples, n_features))
+    bins = np.zeros((n_instances, num_samples, n_features), dtype=np.int64)
+    inverse = np.zeros((n_instances, num_samples, n_features))
+    for feature in range(n_features):
+      cumulative = np.cumsum(self.feature_frequencies[feature])[:-1]
+      bins[:, :, feature] = self.feature_values[feature][np.searchsorted(cumulative, uniform[0, :, :, feature], side='right')]
+      values = bins[:, :, feature]
+      means, stds = self.means[feature][values], self.stds[feature][values]
+      lower = scipy.special.ndtr((self.mins[feature][values] - means) / stds)
+      upper = scipy.special.ndtr((self.maxs[feature][values] - means) / stds)
+      inverse[:, :, feature] = means + stds * scipy.special.ndtri(lower + uniform[1, :, :, feature] * (upper - lower))
+    return bins, inverse
+
+  # Perturbations of the rows of x, which don't depend on the model:
+  # inverse [n, num_samples, 40] (the perturbed signals, float32 as the model sees them),
+  # design [n, num_samples, 40] (binary, same quartile as the instance), kernel weights [n, num_samples], first_row [n, 40]
+  def perturb(self, x, num_samples):
+    bins, inverse = self.sample(len(x), num_samples)
+    inverse[:, 0] = x
+    first_row = self.discretize(x)
+    # Binary design: does the perturbation fall into the instance's quartile (LIME's scaled_data)
+    design = bins == first_row[:, None, :]
+    design[:, 0] = True
+    distances = np.sqrt((~design).sum(2))
+    weights = np.sqrt(np.exp(-(distances ** 2) / self.kernel_width ** 2))
+    return inverse.astype(np.float32), design, weights, first_row
+
+  # The model-dependent part: one forward pass over all perturbations and the ridge solves of every instance and class
+  def fit(self, model, inverse, design, weights):
+    labels = predict_proba(model, np.array(inverse).reshape(-1, inverse.shape[2])).reshape(inverse.shape[0], inverse.shape[1], -1).astype(np.float64)
+    coef, intercept, score = weighted_ridge(np.asarray(design, dtype=np.float64), labels, np.asarray(weights))
+    return coef, intercept, score, intercept + coef.sum(1), labels[:, 0]
+
+  # Explain every row of x for every class
+  # Perturbations, forward passes and ridge solves are done for batch_size instances at a time
+  def explain(self, model, x, num_samples=5000, batch_size=64):
+    x = np.asarray(x)
+    chunks = []
+    with profiler.span('lime'):
+      for start in range(0, len(x), batch_size):
+        inverse, design, weights, first_row = self.perturb(x[start:start + batch_size], num_samples)
+        chunks.append(self.fit(model, inverse, design, weights) + (first_row,))
+    return BatchedExplanation(self, x, *[np.concatenate(parts) for parts in zip(*chunks)])
+
+  # Identifies everything the perturbations depend on: sampling settings and discretizer statistics
+  def settings_digest(self):
+    digest = hashlib.sha1(json.dumps({'random_state': self.seed, 'seed_compatible': self.seed_compatible,
+                                      'kernel_width': float(self.kernel_width)}, sort_keys=True).encode())
+    for stats in (self.bins, self.means, self.stds, self.mins, self.maxs, self.feature_frequencies):
+      for array in stats:
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+# Class probabilities of the model, as the predict_proba of the LIME notebook, in one forward pass
+def predict_proba(model, x):
+  model.eval()
+  with torch.no_grad():
+    return nn.functional.softmax(model(torch.from_numpy(x).float()), dim=1).numpy()
+
+# Ridge regressions with intercept and sample weights (sklearn's Ridge(alpha).fit(X, y, sample_weight)),
+# solved for every instance and every output column at once
+# design [n, samples, features], labels [n, samples, outputs], weights [n, samples]
+def weighted_ridge(design, labels, weights, alpha=1.0):
+  w = weights[:, :, None]
+  total = weights.sum(1)[:, None, None]
+  design_offset = (w * design).sum(1, keepdims=True) / total
+  labels_offset = (w * labels).sum(1, keepdims=True) / total
+  design_c, labels_c = design - design_offset, labels - labels_offset
+  gram = design_c.transpose(0, 2, 1) @ (w * design_c) + alpha * np.eye(design.shape[2])
+  coef = np.linalg.solve(gram, design_c.transpose(0, 2, 1) @ (w * labels_c))
+  intercept = labels_offset[:, 0] - (design_offset @ coef)[:, 0]
+  # Weighted R^2 of the surrogate, LIME's prediction score
+  residual = labels - (design @ coef + intercept[:, None, :])
+  score = 1 - (w * residual ** 2).sum(1) / (w * labels_c ** 2).sum(1)
+  return coef, intercept, score
+
+class BatchedExplanation:
+  # coef [n, 40, n_classes], intercept/score/local_pred [n, n_classes], probabilities [n, n_classes], first_row [n, 40]
+  def __init__(self, explainer, x, coef, intercept, score, local_pred, probabilities, first_row):
+    self.explainer = explainer
+    self.x = x
+    self.coef = coef
+    self.intercept = intercept
+    self.score = score
+    self.local_pred = local_pred
+    self.probabilities = probabilities
+    self.first_row = first_row
+
+  # Labels sorted by predicted probability, highest first, like Explanation.top_labels
+  def top_labels(self, instance):
+    return list(np.argsort(self.probabilities[instance])[::-1])
+
+  # Same table as exp.as_list(label) of lime: (discretized feature name, weight), largest |weight| first
+  def as_list(self, instance, label=1):
+    coef = self.coef[instance, :, label]
+    order = sorted(range(len(coef)), key=lambda feature: np.abs(coef[feature]), reverse=True)
+    return [(self.explainer.names[feature][self.first_row[instance, feature]], coef[feature]) for feature in order]
+
+# Checks the batched explanations of the rows of x against lime_tabular.LimeTabularExplainer (as the LIME notebook
+# creates it) when lime is installed: largest differences of the coefficients and intercepts over all rows and
+# classes, and whether the as_list() feature names agree. Both explainers start from the same random_state and
+# explain the rows in order, so with seed_compatible=True they see the same perturbations.
+def validate_lime(model, training_data, x, num_samples=5000, random_state=42):
+  report = {}
+  try:
+    from lime import lime_tabular
+  except ImportError:
+    return report
+  x = np.asarray(x)
+  n_features = x.shape[1]
+  batched = BatchedLimeExplainer(training_data, random_state=random_state).explain(model, x, num_samples=num_samples)
+  explainer = lime_tabular.LimeTabularExplainer(training_data, mode='classification',
+                                                feature_names=['Feature {}'.format(i) for i in range(n_features)],
+                                                random_state=random_state)
+  coef_error, intercept_error, names_match = 0.0, 0.0, True
+  for instance in range(len(x)):
+    exp = explainer.explain_instance(x[instance], lambda signals: predict_proba(model, signals),
+                                     num_features=n_features, top_labels=batched.coef.shape[2], num_samples=num_samples)
+    for label in exp.available_labels():
+      weights = dict(exp.local_exp[label])
+      coef_error = max(coef_error, max(abs(weights[feature] - batched.coef[instance, feature, label]) for feature in range(n_features)))
+      intercept_error = max(intercept_error, abs(exp.intercept[label] - batched.intercept[instance, label]))
+      names_match &= sorted(name for name, weight in exp.as_list(label)) == sorted(name for name, weight in batched.as_list(instance, label))
+  report['coef_vs_lime'] = float(coef_error)
+  report['intercept_vs_lime'] = float(intercept_error)
+  report['names_match_lime'] = bool(names_match)
+  return report
+
+# Perturbations of a fixed set of explained samples, shared by the models of every width
+# The perturbed signals, design matrix and kernel weights only depend on the training-data statistics and the
+# sampling settings, so they are drawn once and each width only reruns its forward pass and ridge solves.
+# The bank consumes the explainer's random state like explaining x in order would, so build it from a fresh
+# explainer (the notebook creates one with random_state=42 per width, which gives every width the same perturbations).
+# With a cache_dir the arrays are memory-mapped .npy files keyed by the samples, num_samples, random_state
+# and discretizer settings, and are reused by later runs.
+class PerturbationBank:
+  FIELDS = ('inverse', 'design', 'weights', 'first_row')
+
+  def __init__(self, explainer, x, num_samples=5000, batch_size=64, cache_dir=None):
+    self.explainer = explainer
+    self.x = np.asarray(x)
+    self.num_samples = num_samples
+    self.batch_size = batch_size
+    n, n_features = self.x.shape
+    specs = {'inverse': ((n, num_samples, n_features), np.float32), 'design': ((n, num_samples, n_features), np.bool_),
+             'weights': ((n, num_samples), np.float64), 'first_row': ((n, n_features), np.int64)}
+
+    path = None
+    if cache_dir is not None:
+      path = os.path.join(cache_dir, self.key())
+      if os.path.exists(os.path.join(path, 'complete')):
+        for field in self.FIELDS:
+          setattr(self, field, np.load(os.path.join(path, field + '.npy'), mmap_mode='r'))
+        return
+      os.makedirs(path, exist_ok=True)
+    for field, (shape, dtype) in specs.items():
+      setattr(self, field, np.empty(shape, dtype) if path is None else
+              np.lib.format.open_memmap(os.path.join(path, field + '.npy'), mode='w+', dtype=dtype, shape=shape))
+
+    for start in range(0, n, batch_size):
+      chunk = slice(start, start + batch_size)
+      self.inverse[chunk], self.design[chunk], self.weights[chunk], self.first_row[chunk] = explainer.perturb(self.x[chunk], num_samples)
+    if path is not None:
+      for field in self.FIELDS:
+        getattr(self, field).flush()
+      open(os.path.join(path, 'complete'), 'w').close()
+
+  def key(self):
+    digest = hashlib.sha1(self.explainer.settings_digest().encode())
+    digest.update(str(self.num_samples).encode())
+    digest.update(np.ascontiguousarray(self.x).tobytes())
+    return digest.hexdigest()[:16]
+
+  # Explanations of the banked samples for one model
+  def explain(self, model):
+    chunks = []
+    with profiler.span('lime'):
+      for start in range(0, len(self.x), self.batch_size):
+        chunk = slice(start, start + self.batch_size)
+        chunks.append(self.explainer.fit(model, self.inverse[chunk], self.design[chunk], self.weights[chunk]) + (np.asarray(self.first_row[chunk]),))
+    return BatchedExplanation(self.explainer, self.x, *[np.concatenate(parts) for parts in zip(*chunks)])
@@ -0,0 +1,136 @@
+"""Resumable checkpoints for the width sweep.
+
+A checkpoint is keyed by the width, the seed, the epoch budget, the dataset
+arguments and the label-noise rate, and holds the model and optimizer state,
+the epoch counter, the RNG state and the per-epoch metrics. A rerun of the sweep
+skips finished widths and continues unfinished ones from their last saved epoch,
+with the same batch order as an uninterrupted run.
+
+By default a checkpoint is saved after the first epoch that ends `interval`
+seconds (60) after the last save. An interrupted width then recomputes at most
+about a minute of training plus the epoch in progress, and the saves cost at
+most save time / interval. A save writes the model, its momentum buffers and the
+metrics (7 MB at width 900, about 10 ms to a local disk and more to Google
+Drive), which is on the order of an epoch, so saving after every epoch could cost
+as much as the training it protects; benchmarks/bench_checkpoint.py measures
+both. With `every`, a checkpoint is saved every `every` epochs instead and up to
+every - 1 finished epochs are recomputed.
+
+A store with root=None keeps its checkpoints in memory, e.g. to continue runs
+that stopped early within one sweep (see sweep.fit_sweep_adaptive).
+"""
+
+import os
+import copy
+import time
+import json
+import hashlib
+
+import numpy as np
+import torch
+
+from .evaluation import METRICS
+
+class CheckpointStore:
+  # dataset_args are the mnist1d get_dataset_args (an ObjectView or a dict)
+  def __init__(self, root, dataset_args, noise_rate, every=None, interval=60.0):
+    self.root = root
+    self.dataset_args = dict(vars(dataset_args)) if not isinstance(dataset_args, dict) else dict(dataset_args)
+    self.noise_rate = noise_rate
+    self.every = every
+    self.interval = interval
+    self._memory = {}
+    if root is not None:
+      os.makedirs(root, exist_ok=True)
+
+  # Runs with early stopping (see stopping.EarlyStopping) are keyed by its rules too
+  # n_epoch is the budget of fit_model, so a width finished (or saved past the end) at one budget is never taken for another
+  def key(self, n_hidden, seed, stopping=None, n_epoch=1000):
+    config = {'n_hidden': int(n_hidden), 'seed': seed, 'n_epoch': int(n_epoch), 'dataset_args': self.dataset_args,
+              'noise_rate': self.noise_rate}
+    if stopping is not None:
+      config['stopping'] = stopping.settings()
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f'{int(n_hidden)}_nn_{digest}'
+
+  def width(self, n_hidden, seed, stopping=None, n_epoch=1000):
+    key = self.key(n_hidden, seed, stopping, n_epoch)
+    if self.root is None:
+      return self._memory.setdefault(key, WidthCheckpoint(None, self.every, self.interval))
+    return WidthCheckpoint(os.path.join(self.root, key + '.pt'), self.every, self.interval)
+
+class WidthCheckpoint:
+  # path=None keeps the checkpoint in memory only
+  # Saved every `every` epochs, or without it after the first epoch `interval` seconds after the last save
+  def __init__(self, path, every=None, interval=60.0):
+    self.path = path
+    self.every = every
+    self.interval = interval
+    self.saved_at = time.monotonic()
+    self.state = torch.load(path, weights_only=False) if path is not None and os.path.exists(path) else None
+    self.metrics = None
+
+  @property
+  def done(self):
+    return self.state is not None and self.state['done']
+
+  # Results of a finished width: errors_train, errors_test, pred_train, pred_test
+  @property
+  def results(self):
+    return self.state['results']
+
+  # Epoch a finished width stopped early at, None if it ran the full budget
+  @property
+  def stop_epoch(self):
+    return self.state.get('stop_epoch')
+
+  def load_model(self, model):
+    model.load_state_dict(self.state['model'])
+    return model
+
+  # Restore the model, optimizer and RNG from the checkpoint and return the epoch to continue from
+  def resume(self, model, optimizer, n_epoch):
+    self.metrics = np.full((n_epoch, len(METRICS)), np.nan)
+    if self.state is None:
+      return 0
+    model.load_state_dict(self.state['model'])
+    optimizer.load_state_dict(self.state['optimizer'])
+    torch.set_rng_state(self.state['rng'])
+    n_saved = min(n_epoch, len(self.state['metrics']))
+    self.metrics[:n_saved] = self.state['metrics'][:n_saved]
+    print(f'Resuming {"checkpoint" if self.path is None else os.path.basename(self.path)} at epoch {self.state["epoch"]}')
+    self.saved_at = time.monotonic()
+    return self.state['epoch']
+
+  # Record the metrics of a finished epoch and save when one is due
+  def update(self, epoch, model, optimizer, metrics_row):
+    self.metrics[epoch] = metrics_row
+    due = (epoch + 1) % self.every == 0 if self.every is not None else time.monotonic() - self.saved_at >= self.interval
+    # The last epoch is saved by finish, together with the results
+    if due and epoch + 1 < len(self.metrics):
+      self._save(epoch + 1, model, optimizer, done=False)
+
+  # Take over the state of a run that stopped early (from the store's key with the stopping rules) as an
+  # unfinished run, so training it to the full budget continues where it stopped instead of starting over
+  def continue_from(self, stopped):
+    self.state = dict(stopped.state, done=False, results=None, stop_epoch=None)
+    self._write()
+
+  def finish(self, model, optimizer, results, stop_epoch=None):
+    epoch = len(self.metrics) if stop_epoch is None else stop_epoch + 1
+    self._save(epoch, model, optimizer, done=True, results=results, stop_epoch=stop_epoch)
+
+  def _save(self, epoch, model, optimizer, done, results=None, stop_epoch=None):
+    self.state = {'model': model.state_dict(), 'optimizer': optimizer.state_dict(), 'rng': torch.get_rng_state(),
+                  'epoch': epoch, 'metrics': self.metrics.copy(), 'done': done, 'results': results, 'stop_epoch': stop_epoch}
+    self._write()
+
+  def _write(self):
+    if self.path is None:
+      # state_dict tensors share storage with the model, which keeps training
+      self.state = copy.deepcopy(self.state)
+      return
+    # Write to a temporary file first so a crash never leaves a truncated checkpoint behind
+    torch.save(self.state, self.path + '.tmp')
+    os.replace(self.path + '.tmp', self.path)
+    self.saved_at = time.monotonic()
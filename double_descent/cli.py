@@ -0,0 +1,244 @@
+"""Command-line runner for the sweep, without Colab.
+
+    python -m double_descent train --config config.json
+    python -m double_descent explain --config config.json --method shap saliency
+    python -m double_descent analyze --config config.json
+    python -m double_descent plot --config config.json --method shap
+
+The configuration file (JSON, or YAML when PyYAML is installed) replaces the
+edited notebook cells; every key is optional and defaults to DEFAULTS:
+
+    {"output": "results",
+     "dataset": {"num_samples": 8000, "train_split": 0.5, "corr_noise_scale": 0.25, "iid_noise_scale": 0.02,
+                 "cache_dir": "./mnist1d_cache", "noise_rate": 0.15, "noise_seed": 0},
+     "train": {"mode": "parallel", "seed": 0, "loader": "tensor", "checkpoints": true},
+     "explain": {"methods": ["shap", "lime", "saliency"], "n_samples": 100}}
+
+Each subcommand imports torch, mnist1d, the explainers or matplotlib only
+when it runs, so the runner starts quickly and `--help` imports nothing
+heavy. Results go to the output directory:
+
+    output/sweep.npz        hidden_variables, errors, train/test predictions and test labels (train)
+    output/models/          state_dict of every width (train)
+    output/checkpoints/     resumable checkpoints (train, with "checkpoints": true)
+    output/attributions/    AttributionStore of the explained test samples (explain)
+    output/analysis.json    CP/WP counts per regime and regime pattern (analyze)
+    output/double_descent.png, output/plots/<method>/   (plot)
+"""
+
+import os
+import sys
+import json
+import argparse
+
+DEFAULTS = {
+  'output': 'results',
+  'dataset': {'num_samples': 8000, 'train_split': 0.5, 'corr_noise_scale': 0.25, 'iid_noise_scale': 2e-2,
+              'cache_dir': './mnist1d_cache', 'noise_rate': 0.15, 'noise_seed': 0},
+  'train': {'hidden_variables': None, 'mode': 'parallel', 'seed': 0, 'loader': 'tensor', 'n_workers': None,
+            'threads_per_worker': 1, 'checkpoints': True, 'every': None,
+            'interval': 60},
+  'explain': {'methods': ['shap', 'lime', 'saliency'], 'n_samples': 100, 'shap_background': 'kmeans',
+              'shap_size': 100, 'lime_samples': 5000},
+  'plot': {'dpi': 300, 'views': 'symlink', 'n_workers': None},
+}
+
+# Options of the cached dataset that aren't mnist1d dataset arguments
+DATASET_OPTIONS = ('cache_dir', 'noise_rate', 'noise_seed')
+
+def merge(defaults, overrides):
+  merged = dict(defaults)
+  for key, value in overrides.items():
+    merged[key] = merge(defaults[key], value) if isinstance(defaults.get(key), dict) and isinstance(value, dict) else value
+  return merged
+
+def load_config(path):
+  if path is None:
+    return merge(DEFAULTS, {})
+  with open(path) as f:
+    if os.path.splitext(path)[1] in ('.yaml', '.yml'):
+      import yaml
+      config = yaml.safe_load(f)
+    else:
+      config = json.load(f)
+  return merge(DEFAULTS, config or {})
+
+# mnist1d dataset arguments with the configured overrides
+def dataset_args(config):
+  import mnist1d.data
+  args = mnist1d.data.get_dataset_args()
+  for key, value in config['dataset'].items():
+    if key not in DATASET_OPTIONS:
+      setattr(args, key, value)
+  return args
+
+def load_sweep(config):
+  import numpy as np
+  path = os.path.join(config['output'], 'sweep.npz')
+  if not os.path.exists(path):
+    sys.exit(f'No sweep results at {path}, run the train subcommand first')
+  return dict(np.load(path))
+
+def load_models(config, hidden_variables):
+  import torch
+  from .models import get_model
+  models = []
+  for n_hidden in hidden_variables:
+    model = get_model(int(n_hidden))
+    model.load_state_dict(torch.load(os.path.join(config['output'], 'models', f'{int(n_hidden)}_nn.pt')))
+    models.append(model.eval())
+  return models
+
+def train(config, args):
+  import functools
+  import numpy as np
+  import torch
+  from .data import load_dataset
+  from .models import hidden_variables as default_widths
+
+  train_config = config['train']
+  hidden_variables = np.asarray(train_config['hidden_variables'] or default_widths)
+  dataset = config['dataset']
+  mnist_args = dataset_args(config)
+  load = functools.partial(load_dataset, mnist_args, dataset['cache_dir'], dataset['noise_rate'], dataset['noise_seed'])
+  data = load()
+  checkpoints = None
+  if train_config['checkpoints'] and train_config['mode'] != 'zoo':
+    from .checkpoint import CheckpointStore
+    checkpoints = CheckpointStore(os.path.join(config['output'], 'checkpoints'), mnist_args, dataset['noise_rate'],
+                                  every=train_config['every'], interval=train_config['interval'])
+
+  if train_config['mode'] == 'serial':
+    from .sweep import fit_sweep
+    results = fit_sweep(hidden_variables, data, train_config['seed'], checkpoints, loader=train_config['loader'])
+  elif train_config['mode'] == 'parallel':
+    from .sweep import fit_sweep_parallel
+    results = fit_sweep_parallel(hidden_variables, load, train_config['n_workers'], train_config['threads_per_worker'],
+                                 train_config['seed'], checkpoints=checkpoints, loader=train_config['loader'])
+  elif train_config['mode'] == 'zoo':
+    from .zoo import fit_sweep_zoo
+    torch.manual_seed(train_config['seed'])
+    results = fit_sweep_zoo(hidden_variables, data)
+  else:
+    sys.exit(f'Unknown train mode {train_config["mode"]!r}, expected "serial", "parallel" or "zoo"')
+  errors_train_all, errors_test_all, pred_train_all, pred_test_all, models = results
+
+  os.makedirs(os.path.join(config['output'], 'models'), exist_ok=True)
+  np.savez(os.path.join(config['output'], 'sweep.npz'), hidden_variables=hidden_variables, errors_train_all=errors_train_all,
+           errors_test_all=errors_test_all, pred_train_all=pred_train_all, pred_test_all=pred_test_all,
+           y_test=np.asarray(data['y_test']), x_test=np.asarray(data['x_test']), x_train=np.asarray(data['x']),
+           y_train=np.asarray(data['y']), t=np.asarray(data['t']))
+  for n_hidden, model in zip(hidden_variables, models):
+    torch.save(model.state_dict(), os.path.join(config['output'], 'models', f'{int(n_hidden)}_nn.pt'))
+  for n_hidden, errors_train, errors_test in zip(hidden_variables, errors_train_all, errors_test_all):
+    print(f'{int(n_hidden):4d} hidden variables: train error {errors_train:3.2f}, test error {errors_test:3.2f}')
+
+# Attribution functions model -> [n, 40, n_classes] of the samples x, built only for the requested methods
+def explainers(config, methods, sweep, x):
+  import torch
+  explain_config = config['explain']
+  x_train, y_train = torch.from_numpy(sweep['x_train']), torch.from_numpy(sweep['y_train'])
+  cache_dir = os.path.join(config['output'], 'cache')
+  functions = {}
+  for method in methods:
+    if method == 'shap':
+      from .attribution import ShapEngine
+      engine = ShapEngine(x_train, y_train, explain_config['shap_background'], explain_config['shap_size'], cache_dir=cache_dir)
+      functions['shap'] = lambda model: engine.shap_values(model, x)
+    elif method == 'lime':
+      from .batched_lime import BatchedLimeExplainer, PerturbationBank
+      bank = PerturbationBank(BatchedLimeExplainer(sweep['x_train']), x.numpy(), explain_config['lime_samples'], cache_dir=cache_dir)
+      functions['lime'] = lambda model: bank.explain(model).coef
+    elif method == 'saliency':
+      from .saliency import saliency_maps
+      functions['saliency'] = lambda model: saliency_maps(model, x)
+    else:
+      sys.exit(f'Unknown explanation method {method!r}, expected "shap", "lime" or "saliency"')
+  return functions
+
+def explain(config, args):
+  import torch
+  from .store import AttributionStore
+  from .pipeline import to_numpy
+
+  sweep = load_sweep(config)
+  n_samples = config['explain']['n_samples']
+  x = torch.from_numpy(sweep['x_test'][:n_samples])
+  store = AttributionStore(os.path.join(config['output'], 'attributions'), sweep['hidden_variables'], x.numpy(), sweep['t'], sweep['y_test'][:n_samples])
+  functions = explainers(config, args.method or config['explain']['methods'], sweep, x)
+  for n_hidden, model in zip(sweep['hidden_variables'], load_models(config, sweep['hidden_variables'])):
+    store.write_predictions(n_hidden, sweep['pred_test_all'][store.width_index(n_hidden), :n_samples])
+    for method, function in functions.items():
+      print(f'Explaining the model with {int(n_hidden):3d} hidden variables with {method}')
+      store.write(method, n_hidden, to_numpy(function(model)))
+    store.flush()
+
+# CP/WP counts of the test samples per regime and for every CP/WP pattern across the regimes
+def analyze(config, args):
+  import itertools
+  from .query import REGIMES, CorrectnessIndex
+
+  sweep = load_sweep(config)
+  index = CorrectnessIndex(sweep['hidden_variables'], sweep['pred_test_all'], sweep['y_test'])
+  analysis = {'regimes': {}, 'patterns': {}}
+  for name, (lo, hi) in REGIMES.items():
+    analysis['regimes'][name] = {kind: int(index.query((kind, lo, hi)).sum()) for kind in ('CP', 'WP')}
+  for kinds in itertools.product(('CP', 'WP'), repeat=len(REGIMES)):
+    conditions = [(kind, lo, hi) for kind, (lo, hi) in zip(kinds, REGIMES.values())]
+    analysis['patterns']['/'.join(f'{kind} {name}' for kind, name in zip(kinds, REGIMES))] = int(index.query(*conditions).sum())
+  with open(os.path.join(config['output'], 'analysis.json'), 'w') as f:
+    json.dump(analysis, f, indent=1)
+  for name, counts in analysis['regimes'].items():
+    print(f'{name:>7}: {counts["CP"]:5d} CP, {counts["WP"]:5d} WP')
+  for pattern, count in analysis['patterns'].items():
+    print(f'{pattern:>32}: {count:5d}')
+
+def plot(config, args):
+  import matplotlib
+  matplotlib.use('Agg')
+  from matplotlib.figure import Figure
+
+  sweep = load_sweep(config)
+  fig = Figure()
+  ax = fig.subplots()
+  ax.plot(sweep['hidden_variables'], sweep['errors_train_all'], 'r-', label='train')
+  ax.plot(sweep['hidden_variables'], sweep['errors_test_all'], 'b-', label='test')
+  ax.set_xlabel('No hidden variables')
+  ax.set_ylabel('Error')
+  ax.legend()
+  path = os.path.join(config['output'], 'double_descent.png')
+  fig.savefig(path, dpi=config['plot']['dpi'])
+  print(f'Wrote {path}')
+
+  if args.method:
+    from .store import AttributionStore
+    from .render import RenderService
+    store = AttributionStore(os.path.join(config['output'], 'attributions'))
+    for method in args.method:
+      with RenderService(os.path.join(config['output'], 'plots', method), config['plot']['n_workers'], config['plot']['dpi'],
+                         config['plot']['views']) as service:
+        service.submit_store(store, method)
+      print(f'Rendered {method} plots: {service.stats()}')
+
+def parser():
+  parser = argparse.ArgumentParser(prog='python -m double_descent', description=__doc__.splitlines()[0])
+  subparsers = parser.add_subparsers(dest='command', required=True)
+  commands = {'train': (train, 'train the width sweep'), 'explain': (explain, 'attributions of the test samples for every width'),
+              'analyze': (analyze, 'CP/WP analysis of the sweep predictions'), 'plot': (plot, 'double descent curve and attribution plots')}
+  for name, (function, help) in commands.items():
+    subparser = subparsers.add_parser(name, help=help)
+    subparser.add_argument('--config', default=None, help='JSON or YAML configuration file')
+    subparser.add_argument('--output', default=None, help='output directory (overrides the configuration)')
+    if name in ('explain', 'plot'):
+      subparser.add_argument('--method', nargs='+', choices=['shap', 'lime', 'saliency'], default=None,
+                             help='explanation methods' + (' to render' if name == 'plot' else ''))
+    subparser.set_defaults(function=function)
+  return parser
+
+def main(argv=None):
+  args = parser().parse_args(argv)
+  config = load_config(args.config)
+  if args.output is not None:
+    config['output'] = args.output
+  os.makedirs(config['output'], exist_ok=True)
+  args.function(config, args)
@@ -0,0 +1,79 @@
+"""Dataset helpers: a content-addressed MNIST-1D cache, nested training subsets and label-noise injection."""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+# Arrays of the mnist1d dataset dictionary kept in the cache, with the dtypes fit_model uses
+ARRAYS = {'x': np.float32, 'y': np.int64, 'x_test': np.float32, 'y_test': np.int64, 't': np.float32}
+
+# Hash of the dataset arguments (num_samples, train_split, corr_noise_scale, iid_noise_scale, seed, ...)
+# The download url doesn't change the data and is left out
+def dataset_key(args):
+  fields = {name: value for name, value in (args if isinstance(args, dict) else vars(args)).items() if name != 'url'}
+  return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+# mnist1d.data.get_dataset(args, regenerate=True), generated once per set of arguments and then
+# loaded from .npy files in cache_dir. The arrays are copy-on-write memory maps, so every run and every
+# sweep worker shares the same on-disk copy and torch.from_numpy gives zero-copy tensors (see models.get_tensors)
+def get_dataset_cached(args, cache_dir='./mnist1d_cache'):
+  path = os.path.join(cache_dir, dataset_key(args))
+  if not os.path.exists(path):
+    import mnist1d.data
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    data = mnist1d.data.get_dataset(args, path=os.path.join(tmp, 'mnist1d_data.pkl'), download=False, regenerate=True)
+    os.remove(os.path.join(tmp, 'mnist1d_data.pkl'))
+    for name, dtype in ARRAYS.items():
+      np.save(os.path.join(tmp, name + '.npy'), np.asarray(data[name], dtype=dtype))
+    # Publish the finished directory in one rename; if another worker got there first, use its copy
+    try:
+      os.rename(tmp, path)
+    except OSError:
+      shutil.rmtree(tmp)
+  return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='c') for name in ARRAYS}
+
+# The cached dataset with the notebooks' label noise applied to the training labels
+# Deterministic in its arguments, so parallel sweep workers can rebuild the exact same data themselves
+def load_dataset(args, cache_dir='./mnist1d_cache', noise_rate=0.15, noise_seed=0):
+  data = get_dataset_cached(args, cache_dir)
+  data['y'], data['noise_mask'] = add_label_noise(data['y'], noise_rate, rng=np.random.default_rng(noise_seed))
+  return data
+
+# Training-set sizes of a sample-wise sweep as nested subsets of one master dataset:
+# the indices (in dataset order) of the first n samples of one random permutation, for every n in sizes
+def nested_subsets(n_train, sizes, rng=None):
+  order = np.random.default_rng(rng).permutation(n_train)
+  return [np.sort(order[:n]) for n in sizes]
+
+# The dataset dictionary restricted to some training samples; the test split is shared
+def subset(data, indices):
+  data = dict(data)
+  for name in ('x', 'y', 'noise_mask'):
+    if name in data:
+      data[name] = np.ascontiguousarray(data[name][indices])
+  return data
+
+# Replace each label with probability rate by a uniformly drawn class, in one vectorized draw
+# Returns the noisy labels (a copy, the input is left alone) and the boolean mask of the labels that changed;
+# a label redrawn to its own class counts as clean, like in the notebooks' loop
+def add_label_noise(labels, rate=0.15, n_classes=10, rng=None):
+  return next(iter(label_noise_sweep(labels, [rate], n_classes, rng).values()))
+
+# Noisy labels and noise masks for several noise rates from the same draws, so the corrupted sets are nested:
+# every label corrupted at a rate is corrupted the same way at all higher rates
+# Returns {rate: (labels, noise_mask)}
+def label_noise_sweep(labels, rates, n_classes=10, rng=None):
+  rng = np.random.default_rng(rng)
+  labels = np.asarray(labels)
+  uniform = rng.random(len(labels))
+  replacement = rng.integers(0, n_classes, len(labels)).astype(labels.dtype)
+  results = {}
+  for rate in rates:
+    noisy = np.where(uniform < rate, replacement, labels)
+    results[rate] = noisy, noisy != labels
+  return results
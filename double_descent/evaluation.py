@@ -0,0 +1,93 @@
+"""Evaluation schedule for fit_model.
+
+Evaluating the whole training and test set after every epoch roughly doubles
+the cost of training. An Evaluation decides at which epochs the statistics are
+computed (every `every` epochs or at an explicit list of epochs, on the full
+splits or on a fixed random sample of them), runs the forward passes under
+torch.inference_mode into preallocated buffers and keeps the results in a
+compact [n_evaluated_epochs, 4] metrics array. The final epoch is always
+evaluated on the full splits, so the errors and predictions fit_model returns
+don't depend on the schedule. With a recorder (see recorder.MetricsRecorder)
+every evaluated row is also recorded to disk.
+"""
+
+import numpy as np
+import torch, torch.nn as nn
+
+# Columns of the metrics array
+METRICS = ('train_loss', 'train_error', 'test_loss', 'test_error')
+
+class Evaluation:
+  def __init__(self, every=1, epochs=None, sample=None, seed=0, recorder=None):
+    self.every = every
+    self.requested_epochs = epochs
+    self.sample = sample
+    self.seed = seed
+    self.recorder = recorder
+
+  # The sorted epochs that will be evaluated in a run of n_epoch epochs
+  def schedule(self, n_epoch):
+    if self.requested_epochs is not None:
+      epochs = {int(epoch) for epoch in self.requested_epochs if 0 <= epoch < n_epoch}
+    else:
+      epochs = set(range(0, n_epoch, self.every))
+    epochs.add(n_epoch - 1)
+    return np.array(sorted(epochs))
+
+  def start(self, model, x_train, y_train, x_test, y_test, n_epoch):
+    self.model = model
+    self.n_epoch = n_epoch
+    self.epochs = self.schedule(n_epoch)
+    self.metrics = np.full((len(self.epochs), len(METRICS)), np.nan, dtype=np.float32)
+    self._rows = {int(epoch): row for row, epoch in enumerate(self.epochs)}
+    self.full = {'train': (x_train, y_train), 'test': (x_test, y_test)}
+    self.sampled = self.full
+    if self.sample is not None:
+      generator = torch.Generator().manual_seed(self.seed)
+      self.sampled = {}
+      for split, (x, y) in self.full.items():
+        index = torch.randperm(len(x), generator=generator)[:self.sample]
+        self.sampled[split] = (x[index], y[index])
+    self._buffers = {}
+    # The buffered forward pass handles the Linear/ReLU stacks built by get_model, anything else runs model(x)
+    self._buffered = isinstance(model, nn.Sequential) and all(isinstance(module, (nn.Linear, nn.ReLU)) for module in model)
+
+  def due(self, epoch):
+    return epoch in self._rows
+
+  # Forward pass writing every layer's output into a buffer allocated on the first call
+  def forward(self, x, key):
+    if not self._buffered:
+      return self.model(x)
+    buffers = self._buffers.get(key)
+    if buffers is None:
+      buffers = [torch.empty(len(x), module.out_features, dtype=x.dtype, device=x.device) if isinstance(module, nn.Linear) else None for module in self.model]
+      self._buffers[key] = buffers
+    h = x
+    for module, out in zip(self.model, buffers):
+      if isinstance(module, nn.Linear):
+        h = torch.addmm(module.bias, h, module.weight.t(), out=out)
+      else:
+        h = torch.relu_(h)
+    return h
+
+  # Errors, losses and predicted classes of the model on both splits
+  # The final epoch (the last one, or the one training stopped at) is evaluated on the full splits,
+  # the others on the sample if there is one
+  def evaluate(self, epoch, loss_function, final=None):
+    final = epoch == self.n_epoch - 1 if final is None else final
+    splits = self.full if final else self.sampled
+    results = {}
+    with torch.inference_mode():
+      for split, (x, y) in splits.items():
+        pred = self.forward(x, (split, len(x)))
+        _, predicted_class = torch.max(pred, 1)
+        errors = 100 - 100 * (predicted_class == y).float().sum() / len(y)
+        results[split] = (errors, loss_function(pred, y).item(), predicted_class)
+    (errors_train, losses_train, predicted_train_class), (errors_test, losses_test, predicted_test_class) = results['train'], results['test']
+    self.metrics[self._rows[epoch]] = losses_train, float(errors_train), losses_test, float(errors_test)
+    if self.recorder is not None:
+      self.recorder.record(epoch, self.metrics[self._rows[epoch]])
+      if final:
+        self.recorder.finish()
+    return errors_train, errors_test, losses_train, losses_test, predicted_train_class, predicted_test_class
@@ -0,0 +1,109 @@
+"""Warm-started width sweep: each width grows out of the trained previous one.
+
+The cold sweep (the notebooks, fit_sweep) initializes every width with a
+fresh weights_init. In growth mode, width k' starts from the trained width-k
+network widened without changing its function: the first k units of both
+hidden layers keep their trained weights, the k' - k new units get fresh
+Kaiming incoming weights, and every weight out of a new unit into an old unit
+or the output starts at zero. The new units then learn from the first step
+on, as the gradients of their outgoing weights aren't zero.
+
+Cold start remains the default for curves faithful to the paper; growth_report
+compares the curve shape and the compute of both modes.
+"""
+
+import time
+
+import numpy as np
+import torch, torch.nn as nn
+
+from . import profiler
+from .models import D_i, D_o, get_model, fit_model
+from .sweep import empty_results, fit_sweep, fit_sweep_adaptive
+
+# Parameters of the get_model MLP of a width
+def n_parameters(n_hidden):
+  return (D_i + 1) * n_hidden + (n_hidden + 1) * n_hidden + (n_hidden + 1) * D_o
+
+# A model of width n_hidden computing the same function as the trained, narrower model
+def widen(model, n_hidden):
+  old = [module for module in model if isinstance(module, nn.Linear)]
+  wide = get_model(int(n_hidden))
+  new = [module for module in wide if isinstance(module, nn.Linear)]
+  k = old[0].out_features
+  if n_hidden < k:
+    raise ValueError(f'Can only widen, not shrink a model with {k} hidden variables to {n_hidden}')
+  with torch.no_grad():
+    new[0].weight[:k] = old[0].weight
+    new[0].bias[:k] = old[0].bias
+    new[1].weight[:k, :k] = old[1].weight
+    new[1].weight[:k, k:] = 0
+    new[1].bias[:k] = old[1].bias
+    new[2].weight[:, :k] = old[2].weight
+    new[2].weight[:, k:] = 0
+    new[2].bias[:] = old[2].bias
+  return wide
+
+# The width sweep in growth mode: widths in increasing order, each widened from the one before
+# (the first one is cold-started), all trained with fit_model and the optional EarlyStopping
+# Returns the fit_sweep results and the number of epochs each width was trained for
+def fit_sweep_growth(hidden_variables, data, seed=None, stopping=None, n_epoch=1000, **fit_kwargs):
+  errors_train_all, errors_test_all, pred_train_all, pred_test_all = empty_results(hidden_variables, data)
+  models = [None] * len(hidden_variables)
+  epochs_all = np.zeros(len(hidden_variables), dtype=np.int64)
+  if seed is not None:
+    torch.manual_seed(seed)
+
+  previous = None
+  for c_hidden in np.argsort(np.asarray(hidden_variables), kind='stable'):
+    print("#"*100)
+    print(f'Training model with {hidden_variables[c_hidden]:3d} hidden variables' + ('' if previous is None else f', grown from {previous[0].out_features:3d}'))
+    model = get_model(int(hidden_variables[c_hidden])) if previous is None else widen(previous, hidden_variables[c_hidden])
+    with profiler.width(hidden_variables[c_hidden]):
+      errors_train, errors_test, pred_train, pred_test = fit_model(model, data, stopping=stopping, n_epoch=n_epoch, **fit_kwargs)
+    errors_train_all[c_hidden], errors_test_all[c_hidden] = float(errors_train), float(errors_test)
+    pred_train_all[c_hidden], pred_test_all[c_hidden] = pred_train.numpy(), pred_test.numpy()
+    models[c_hidden] = model
+    epochs_all[c_hidden] = n_epoch if stopping is None or stopping.stop_epoch is None else stopping.stop_epoch + 1
+    previous = model
+
+  return errors_train_all, errors_test_all, pred_train_all, pred_test_all, models, epochs_all
+
+# Curve shape and compute of a cold and a warm-started sweep
+# cold and warm are (errors_test_all, epochs_all, seconds); compute is counted in parameter-epochs,
+# proportional to the training FLOPs
+def growth_report(hidden_variables, cold, warm):
+  hidden_variables = np.asarray(hidden_variables)
+  rows = {}
+  for mode, (errors_test_all, epochs_all, seconds) in (('cold', cold), ('warm', warm)):
+    rows[mode] = {'peak_width': int(hidden_variables[np.argmax(errors_test_all)]), 'peak_error': float(np.max(errors_test_all)),
+                  'final_error': float(errors_test_all[np.argmax(hidden_variables)]), 'epochs': int(np.sum(epochs_all)),
+                  'parameter_epochs': float(np.sum(epochs_all * n_parameters(hidden_variables))), 'seconds': float(seconds)}
+  difference = np.asarray(warm[0]) - np.asarray(cold[0])
+  report = {'cold': rows['cold'], 'warm': rows['warm'],
+            'max_error_difference': float(np.max(np.abs(difference))), 'mean_error_difference': float(np.mean(difference)),
+            'curve_correlation': float(np.corrcoef(cold[0], warm[0])[0, 1]),
+            'compute_ratio': rows['warm']['parameter_epochs'] / rows['cold']['parameter_epochs']}
+
+  print(f'{"":>6} {"peak width":>10} {"peak error":>10} {"final error":>11} {"epochs":>8} {"param-epochs":>13} {"seconds":>9}')
+  for mode, row in rows.items():
+    print(f'{mode:>6} {row["peak_width"]:10d} {row["peak_error"]:10.2f} {row["final_error"]:11.2f} {row["epochs"]:8d} {row["parameter_epochs"]:13.3g} {row["seconds"]:9.1f}')
+  print(f'Test error difference (warm - cold): max |{report["max_error_difference"]:.2f}|, mean {report["mean_error_difference"]:+.2f}; '
+        f'curve correlation {report["curve_correlation"]:.3f}; warm compute {100 * report["compute_ratio"]:.1f}% of cold')
+  return report
+
+# Run the sweep cold (fit_sweep, or fit_sweep_adaptive without refinement when there is a stopping rule)
+# and in growth mode with the same stopping rule and epoch budget, and report both
+def compare_growth(hidden_variables, data, seed=0, stopping=None, n_epoch=1000, **fit_kwargs):
+  start = time.perf_counter()
+  if stopping is None:
+    cold = fit_sweep(hidden_variables, data, seed, n_epoch=n_epoch, **fit_kwargs)
+    cold_epochs = np.full(len(hidden_variables), n_epoch)
+  else:
+    *cold, cold_epochs, cold_stop_epochs = fit_sweep_adaptive(hidden_variables, data, stopping, refine=False, seed=seed, n_epoch=n_epoch, **fit_kwargs)
+  cold_seconds = time.perf_counter() - start
+  start = time.perf_counter()
+  *warm, warm_epochs = fit_sweep_growth(hidden_variables, data, seed, stopping, n_epoch, **fit_kwargs)
+  warm_seconds = time.perf_counter() - start
+  report = growth_report(hidden_variables, (cold[1], cold_epochs, cold_seconds), (warm[1], warm_epochs, warm_seconds))
+  return report, cold, warm
@@ -0,0 +1,198 @@
+import numpy as np
+import torch, torch.nn as nn
+from torch.utils.data import TensorDataset, DataLoader
+
+from . import profiler
+from .evaluation import METRICS, Evaluation
+
+D_i = 40    # Input dimensions
+D_o = 10    # Output dimensions
+
+# The width ladder used by all three notebooks
+hidden_variables = np.array([2,4,6,8,10,14,18,22,26,30,35,40,45,50,55,60,70,80,90,100,120,140,160,180,200,250,300,400, 500, 600, 700, 800, 900])
+
+# Initialize the parameters with He initialization
+def weights_init(layer_in):
+  if isinstance(layer_in, nn.Linear):
+    nn.init.kaiming_uniform_(layer_in.weight)
+    layer_in.bias.data.fill_(0.0)
+
+# Return an initialized model with two hidden layers and n_hidden hidden units at each
+def get_model(n_hidden):
+
+  D_k = n_hidden   # Hidden dimensions
+
+  # Define a model with two hidden layers of size n_hidden
+  # And ReLU activations between them
+  model = nn.Sequential(
+  nn.Linear(D_i, D_k),
+  nn.ReLU(),
+  nn.Linear(D_k, D_k),
+  nn.ReLU(),
+  nn.Linear(D_k, D_o))
+
+  # Call the function you just defined
+  model.apply(weights_init)
+
+  # Return the model
+  return model
+
+# Convert the numpy arrays of the dataset dictionary to training and test tensors
+# Arrays that already have the right dtype (e.g. from data.get_dataset_cached) are shared, not copied
+def get_tensors(data):
+  x_train = torch.from_numpy(np.asarray(data['x'], dtype=np.float32))
+  y_train = torch.from_numpy(np.asarray(data['y'], dtype=np.int64))
+  x_test= torch.from_numpy(np.asarray(data['x_test'], dtype=np.float32))
+  y_test = torch.from_numpy(np.asarray(data['y_test'], dtype=np.int64))
+  return x_train, y_train, x_test, y_test
+
+# Shuffled batches of tensors that stay resident on their device, without DataLoader and collate overhead
+# Each epoch gathers the whole shuffled dataset into preallocated buffers with one index_select,
+# and the batches are fixed views into those buffers
+class TensorBatches:
+  def __init__(self, x, y, batch_size=100):
+    self.x = x.contiguous()
+    self.y = y.contiguous()
+    self.x_epoch = torch.empty_like(self.x)
+    self.y_epoch = torch.empty_like(self.y)
+    self.x_batches = self.x_epoch.split(batch_size)
+    self.y_batches = self.y_epoch.split(batch_size)
+
+  def __len__(self):
+    return len(self.x_batches)
+
+  def __iter__(self):
+    # Draw the permutation exactly like DataLoader(shuffle=True) does (one draw for the loader's base seed,
+    # one for the sampler's generator), so both paths see the same batches for the same torch seed
+    torch.empty((), dtype=torch.int64).random_()
+    generator = torch.Generator()
+    generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+    perm = torch.randperm(len(self.x), generator=generator).to(self.x.device)
+    torch.index_select(self.x, 0, perm, out=self.x_epoch)
+    torch.index_select(self.y, 0, perm, out=self.y_epoch)
+    return zip(self.x_batches, self.y_batches)
+
+# Batches of the training set: 'dataloader' is the original DataLoader/TensorDataset path, 'tensor' the TensorBatches fast path
+def get_batches(x_train, y_train, batch_size=100, loader='dataloader'):
+  if loader == 'dataloader':
+    return DataLoader(TensorDataset(x_train,y_train), batch_size=batch_size, shuffle=True, worker_init_fn=np.random.seed(1))
+  if loader == 'tensor':
+    return TensorBatches(x_train, y_train, batch_size)
+  raise ValueError(f'Unknown loader {loader!r}, expected "dataloader" or "tensor"')
+
+# Whether this CPU has native bfloat16 support (AVX512-BF16 or AMX) that oneDNN can use
+def bf16_supported():
+  try:
+    return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+  except (AttributeError, RuntimeError):
+    return False
+
+# A training step on one batch, as a replacement for the loop body of train_epoch
+# compile runs the forward pass, the loss and its backward pass as one torch.compile'd graph and
+# the SGD update as a second one; bf16 runs the forward pass and the loss under bfloat16 autocast
+# (the weights, gradients and the optimizer stay float32) on CPUs that support it
+def make_train_step(model, optimizer, loss_function, compile=False, bf16=False):
+  if bf16 and not bf16_supported():
+    print('This CPU has no native bfloat16 support, training in float32')
+    bf16 = False
+
+  def forward_loss(x_batch, y_batch):
+    with torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+      return loss_function(model(x_batch), y_batch)
+
+  optimizer_step = optimizer.step
+  if compile:
+    forward_loss = torch.compile(forward_loss)
+    optimizer_step = torch.compile(optimizer.step)
+
+  def step(x_batch, y_batch):
+    optimizer.zero_grad()
+    loss = forward_loss(x_batch, y_batch)
+    loss.backward()
+    optimizer_step()
+  return step
+
+# One pass over the batches of the training set
+# With a step from make_train_step, each batch runs through it instead of the eager loop body
+def train_epoch(model, optimizer, loss_function, batches, step=None):
+  batches = profiler.timed_batches(batches)
+  if step is not None:
+    for x_batch, y_batch in batches:
+      step(x_batch, y_batch)
+    return
+  # loop over batches
+  for x_batch, y_batch in batches:
+    # zero the parameter gradients
+    optimizer.zero_grad()
+    # forward pass -- calculate model output
+    pred = model(x_batch)
+    # compute the loss
+    loss = loss_function(pred, y_batch)
+    # backward pass
+    loss.backward()
+    # SGD update
+    optimizer.step()
+
+# With a checkpoint (see checkpoint.py) training continues from its last saved epoch
+# and the per-epoch metrics are recorded and saved along with the model
+# loader selects how batches are drawn (see get_batches); both give the same results for the same seed
+# evaluation is an Evaluation (see evaluation.py) deciding when and on what the statistics are computed;
+# the default evaluates the full splits after every epoch, and its metrics array holds the recorded curve
+# stopping is an EarlyStopping (see stopping.py) that can end training before the last epoch
+# compile and bf16 select the compiled and the bfloat16 training step (see make_train_step); evaluation stays float32
+def fit_model(model, data, checkpoint=None, loader='dataloader', evaluation=None, stopping=None, compile=False, bf16=False, n_epoch=1000):
+
+  # choose cross entropy loss function (equation 5.24)
+  loss_function = torch.nn.CrossEntropyLoss()
+  # construct SGD optimizer and initialize learning rate and momentum
+  optimizer = torch.optim.SGD(model.parameters(), lr = 0.01, momentum=0.9)
+
+  x_train, y_train, x_test, y_test = get_tensors(data)
+
+  # load the data into a class that creates the batches
+  data_loader = get_batches(x_train, y_train, batch_size=100, loader=loader)
+  step = make_train_step(model, optimizer, loss_function, compile, bf16) if compile or bf16 else None
+
+  # loop over the dataset n_epoch times
+  start_epoch = 0 if checkpoint is None else checkpoint.resume(model, optimizer, n_epoch)
+  evaluation = Evaluation() if evaluation is None else evaluation
+  evaluation.start(model, x_train, y_train, x_test, y_test, n_epoch)
+  if stopping is not None:
+    stopping.start()
+    # A resumed run gives the stopping rules the history saved before the interruption
+    for epoch in range(start_epoch):
+      if not np.isnan(checkpoint.metrics[epoch, 0]):
+        stopping.update(epoch, checkpoint.metrics[epoch])
+
+  for epoch in range(start_epoch, n_epoch):
+    profiler.set_epoch(epoch)
+    with profiler.span('train_epoch'):
+      train_epoch(model, optimizer, loss_function, data_loader, step)
+
+    # Run whole dataset (or the evaluation sample) to get statistics at the scheduled epochs
+    metrics_row = (np.nan,) * len(METRICS)
+    stop = False
+    if evaluation.due(epoch):
+      with profiler.span('evaluate'):
+        errors_train, errors_test, losses_train, losses_test, predicted_train_class, predicted_test_class = evaluation.evaluate(epoch, loss_function)
+      metrics_row = (losses_train, float(errors_train), losses_test, float(errors_test))
+      if epoch%100 ==0 :
+        print(f'Epoch {epoch:5d}, train loss {losses_train:.6f}, train error {errors_train:3.2f},  test loss {losses_test:.6f}, test error {errors_test:3.2f}')
+      stop = stopping is not None and epoch < n_epoch - 1 and stopping.update(epoch, metrics_row)
+      if stop:
+        # The results of a stopped run come from the full splits, like those of the last epoch
+        with profiler.span('evaluate'):
+          errors_train, errors_test, losses_train, losses_test, predicted_train_class, predicted_test_class = evaluation.evaluate(epoch, loss_function, final=True)
+        metrics_row = (losses_train, float(errors_train), losses_test, float(errors_test))
+        print(f'Stopping at epoch {epoch:5d} ({stopping.reason}), train loss {losses_train:.6f}, train error {errors_train:3.2f},  test loss {losses_test:.6f}, test error {errors_test:3.2f}')
+    if checkpoint is not None:
+      with profiler.span('checkpoint'):
+        checkpoint.update(epoch, model, optimizer, metrics_row)
+    if stop:
+      break
+
+  if checkpoint is not None:
+    checkpoint.finish(model, optimizer, (errors_train, errors_test, predicted_train_class, predicted_test_class),
+                      None if stopping is None else stopping.stop_epoch)
+
+  return errors_train, errors_test, predicted_train_class, predicted_test_class
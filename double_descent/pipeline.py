@@ -0,0 +1,202 @@
+"""Overlapped train -> explain -> persist pipeline for the width sweep.
+
+The notebook loops train a width, explain it, then plot and save, strictly
+in turn, so no training happens while attributions are computed and JPEGs
+are encoded. A SweepPipeline runs the three as stages connected by bounded
+queues:
+
+    train (main thread) --trained--> explain (n_explainers threads) --records--> write (one thread)
+
+Training of the next width goes on while the explainers work on the previous
+ones; when a queue is full the stage feeding it blocks (back-pressure), so at
+most max_trained trained models and max_records attribution arrays wait in
+memory. The writer puts attributions and predictions into an AttributionStore
+and, with a RenderService, queues their plots for its process pool.
+
+stats() reports the depth of each queue, how long each stage was blocked on a
+full queue and how busy its workers were; monitor_every prints it periodically.
+"""
+
+import time
+import queue
+import threading
+
+import numpy as np
+import torch
+
+from . import profiler
+from .sweep import empty_results, fit_width, width_seed
+
+# Counters of one stage
+class StageStats:
+  def __init__(self, name, n_workers=1):
+    self.name = name
+    self.n_workers = n_workers
+    self.items = 0
+    self.busy = 0.0
+    self.blocked = 0.0
+    self.lock = threading.Lock()
+
+  def add(self, busy=0.0, blocked=0.0, items=0):
+    with self.lock:
+      self.busy += busy
+      self.blocked += blocked
+      self.items += items
+
+# A bounded queue that records its depth at every put and how long puts were blocked
+class MonitoredQueue(queue.Queue):
+  def __init__(self, name, maxsize):
+    super().__init__(maxsize)
+    self.name = name
+    self.max_depth = 0
+    self.depth_sum = 0
+    self.n_puts = 0
+
+  def put(self, item, stage=None):
+    start = time.perf_counter()
+    super().put(item)
+    if stage is not None:
+      stage.add(blocked=time.perf_counter() - start)
+    depth = self.qsize()
+    self.max_depth = max(self.max_depth, depth)
+    self.depth_sum += depth
+    self.n_puts += 1
+
+def to_numpy(values):
+  return values.detach().cpu().numpy() if torch.is_tensor(values) else np.asarray(values)
+
+# Explainers for the samples x of an AttributionStore, each a function model -> [n, 40, n_classes]
+# engine is an attribution.ShapEngine, bank a batched_lime.PerturbationBank of the same samples
+def default_explainers(x, engine=None, bank=None, saliency=True):
+  explainers = {}
+  if engine is not None:
+    explainers['shap'] = lambda model: engine.shap_values(model, x)
+  if bank is not None:
+    explainers['lime'] = lambda model: bank.explain(model).coef
+  if saliency:
+    from .saliency import saliency_maps
+    explainers['saliency'] = lambda model: saliency_maps(model, x)
+  return explainers
+
+class SweepPipeline:
+  # store is the AttributionStore of the explained samples (store.x), explainers a dict method -> function(model),
+  # render an optional RenderService; monitor_every prints stats() every so many seconds
+  def __init__(self, store, explainers, n_explainers=1, max_trained=2, max_records=8, render=None, monitor_every=None):
+    self.store = store
+    self.explainers = explainers
+    self.n_explainers = n_explainers
+    self.render = render
+    self.monitor_every = monitor_every
+    self.x = torch.from_numpy(np.asarray(store.x, dtype=np.float32))
+    self.trained = MonitoredQueue('trained', max_trained)
+    self.records = MonitoredQueue('records', max_records)
+    self.stages = {'train': StageStats('train'), 'explain': StageStats('explain', n_explainers), 'write': StageStats('write')}
+    self.errors = []
+    self.start = None
+
+  # Explainer worker: attributions of every method for each trained model
+  def _explain(self):
+    stage = self.stages['explain']
+    while True:
+      item = self.trained.get()
+      if item is None:
+        break
+      n_hidden, model = item
+      # After an error the queue is still drained, so training never blocks on a dead stage
+      if self.errors:
+        continue
+      try:
+        start = time.perf_counter()
+        with profiler.span('explain', width=n_hidden):
+          with torch.no_grad():
+            predictions = to_numpy(model(self.x).argmax(1))
+          records = [(method, n_hidden, to_numpy(explain(model)), predictions) for method, explain in self.explainers.items()]
+        stage.add(busy=time.perf_counter() - start, items=1)
+        for record in records:
+          self.records.put(record, stage)
+      except BaseException as error:
+        self.errors.append(error)
+
+  # Writer: attributions and predictions into the store, plots into the render queue
+  def _write(self):
+    stage = self.stages['write']
+    while True:
+      record = self.records.get()
+      if record is None:
+        break
+      if self.errors:
+        continue
+      try:
+        start = time.perf_counter()
+        method, n_hidden, attributions, predictions = record
+        with profiler.span('write', width=n_hidden):
+          self.store.write(method, n_hidden, attributions)
+          self.store.write_predictions(n_hidden, predictions)
+          self.store.flush()
+          if self.render is not None:
+            self.render.submit_store(self.store, method, widths=[n_hidden])
+        stage.add(busy=time.perf_counter() - start, items=1)
+      except BaseException as error:
+        self.errors.append(error)
+
+  def _monitor(self, done):
+    while not done.wait(self.monitor_every):
+      self.report()
+
+  # Train every width with fit_width (the arguments of fit_sweep) and explain and persist it in the background
+  # Returns the fit_sweep results once every width is written
+  def run(self, hidden_variables, data, seed=None, checkpoints=None, **fit_kwargs):
+    errors_train_all, errors_test_all, pred_train_all, pred_test_all = empty_results(hidden_variables, data)
+    models = [None] * len(hidden_variables)
+    self.start = time.perf_counter()
+    explainers = [threading.Thread(target=self._explain, name=f'explain-{i}', daemon=True) for i in range(self.n_explainers)]
+    writer = threading.Thread(target=self._write, name='write', daemon=True)
+    done = threading.Event()
+    threads = explainers + [writer]
+    if self.monitor_every is not None:
+      threads.append(threading.Thread(target=self._monitor, args=(done,), name='monitor', daemon=True))
+    for thread in threads:
+      thread.start()
+
+    stage = self.stages['train']
+    try:
+      for c_hidden in range(len(hidden_variables)):
+        if self.errors:
+          break
+        print("#"*100)
+        print(f'Training model with {hidden_variables[c_hidden]:3d} hidden variables')
+        start = time.perf_counter()
+        errors_train_all[c_hidden], errors_test_all[c_hidden], pred_train_all[c_hidden], pred_test_all[c_hidden], models[c_hidden] = \
+          fit_width(hidden_variables[c_hidden], data, width_seed(seed, c_hidden), checkpoints, **fit_kwargs)
+        stage.add(busy=time.perf_counter() - start, items=1)
+        models[c_hidden].eval()
+        self.trained.put((int(hidden_variables[c_hidden]), models[c_hidden]), stage)
+    finally:
+      for explainer in explainers:
+        self.trained.put(None)
+      for explainer in explainers:
+        explainer.join()
+      self.records.put(None)
+      writer.join()
+      done.set()
+
+    if self.errors:
+      raise self.errors[0]
+    return errors_train_all, errors_test_all, pred_train_all, pred_test_all, models
+
+  # Per stage: items done, utilization (busy time over wall time and workers) and time blocked on a full queue;
+  # per queue: capacity, current, mean and maximum depth
+  def stats(self):
+    seconds = time.perf_counter() - self.start if self.start is not None else 0.0
+    stages = {name: {'items': stage.items, 'utilization': stage.busy / (seconds * stage.n_workers) if seconds > 0 else 0.0,
+                     'blocked_seconds': stage.blocked} for name, stage in self.stages.items()}
+    queues = {q.name: {'maxsize': q.maxsize, 'depth': q.qsize(), 'mean_depth': q.depth_sum / q.n_puts if q.n_puts else 0.0,
+                       'max_depth': q.max_depth} for q in (self.trained, self.records)}
+    return {'seconds': seconds, 'stages': stages, 'queues': queues}
+
+  def report(self):
+    stats = self.stats()
+    stages = ', '.join(f'{name} {s["items"]} done {100 * s["utilization"]:.0f}% busy {s["blocked_seconds"]:.1f}s blocked'
+                       for name, s in stats['stages'].items())
+    queues = ', '.join(f'{name} {q["depth"]}/{q["maxsize"]} (max {q["max_depth"]})' for name, q in stats['queues'].items())
+    print(f'[{stats["seconds"]:7.1f}s] {stages}; queues {queues}')
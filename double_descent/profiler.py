@@ -0,0 +1,175 @@
+"""Phase profiler for sweep runs.
+
+With a Profiler active, the instrumented code (fit_width, fit_model,
+train_epoch, the explainers, plot rendering) records a span for each phase,
+tagged with the width being trained and the epoch bucket (epoch_bucket epochs
+per bucket). The time train_epoch spends waiting for batches is summed per
+epoch as the 'batches' phase. At the end of the run summary() prints the
+time per phase (and per width), and save_trace writes the spans as a Chrome
+trace (chrome://tracing or https://ui.perfetto.dev). With torch_width,
+torch.profiler also captures the training of that width into its own trace.
+
+    with Profiler(epoch_bucket=100, torch_width=100, output_dir='profile') as profiler:
+      fit_sweep(hidden_variables, data)
+
+Without an active Profiler, span() returns one shared no-op context manager,
+so the instrumentation costs a function call per phase.
+"""
+
+import os
+import time
+import json
+import threading
+import contextlib
+import collections
+
+# The active Profiler, if any
+_active = None
+
+_NULL = contextlib.nullcontext()
+
+def active():
+  return _active is not None
+
+# A span of phase name around a block, e.g. with span('evaluate'): ...
+# width tags it (and the spans inside it on the same thread) with that width and no epoch bucket, for work done
+# on other threads than the training
+def span(name, width=None):
+  if _active is None:
+    return _NULL
+  return _active.span(name, width)
+
+def set_epoch(epoch):
+  if _active is not None:
+    _active.epoch = epoch
+
+# Training of one width: a 'fit_width' span, the width tag of the spans inside and the optional torch.profiler capture
+def width(n_hidden):
+  if _active is None:
+    return _NULL
+  return _active.width_span(int(n_hidden))
+
+# Iterate over batches, adding the time spent waiting for them to the 'batches' phase
+def timed_batches(batches):
+  if _active is None:
+    return batches
+  return _active.timed_batches(batches)
+
+class Profiler:
+  def __init__(self, epoch_bucket=100, torch_width=None, output_dir=None):
+    self.epoch_bucket = epoch_bucket
+    self.torch_width = torch_width
+    self.output_dir = output_dir
+    # The width and epoch tags are kept per thread, so spans of the pipeline's explain and write threads
+    # aren't tagged with the width and epoch the training thread is on
+    self._context = threading.local()
+    # (name, width, epoch bucket, start, duration, thread id), times in seconds from the start
+    self.spans = []
+    self.start = None
+
+  def __enter__(self):
+    global _active
+    self.start = time.perf_counter()
+    _active = self
+    return self
+
+  def __exit__(self, *exc):
+    global _active
+    _active = None
+    self.seconds = time.perf_counter() - self.start
+    if self.output_dir is not None:
+      os.makedirs(self.output_dir, exist_ok=True)
+      self.save_trace(os.path.join(self.output_dir, 'trace.json'))
+      self.summary()
+
+  @property
+  def width(self):
+    return getattr(self._context, 'width', None)
+
+  @width.setter
+  def width(self, width):
+    self._context.width = width
+
+  @property
+  def epoch(self):
+    return getattr(self._context, 'epoch', None)
+
+  @epoch.setter
+  def epoch(self, epoch):
+    self._context.epoch = epoch
+
+  def _bucket(self):
+    return None if self.epoch is None else self.epoch // self.epoch_bucket * self.epoch_bucket
+
+  def _record(self, name, start, duration):
+    self.spans.append((name, self.width, self._bucket(), start - self.start, duration, threading.get_ident()))
+
+  @contextlib.contextmanager
+  def span(self, name, width=None):
+    outer = self.width, self.epoch
+    if width is not None:
+      self.width, self.epoch = width, None
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self._record(name, start, time.perf_counter() - start)
+      if width is not None:
+        self.width, self.epoch = outer
+
+  @contextlib.contextmanager
+  def width_span(self, n_hidden):
+    self.width, self.epoch = n_hidden, None
+    capture = None
+    if n_hidden == self.torch_width:
+      import torch.profiler
+      capture = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+      capture.__enter__()
+    try:
+      with self.span('fit_width'):
+        yield
+    finally:
+      if capture is not None:
+        capture.__exit__(None, None, None)
+        capture.export_chrome_trace(os.path.join(self.output_dir or '.', f'torch_trace_{n_hidden}.json'))
+      self.width, self.epoch = None, None
+
+  def timed_batches(self, batches):
+    waited = 0.0
+    iterator = iter(batches)
+    start_epoch = time.perf_counter()
+    while True:
+      start = time.perf_counter()
+      try:
+        batch = next(iterator)
+      except StopIteration:
+        break
+      waited += time.perf_counter() - start
+      yield batch
+    # One span per epoch with the summed waiting time, placed at the start of the epoch
+    self._record('batches', start_epoch, waited)
+
+  # Total seconds, count and mean milliseconds per phase (and per width with by_width)
+  def totals(self, by_width=False):
+    totals = collections.defaultdict(lambda: [0.0, 0])
+    for name, width, bucket, start, duration, thread in self.spans:
+      total = totals[(name, width) if by_width else name]
+      total[0] += duration
+      total[1] += 1
+    return {key: {'seconds': seconds, 'count': count, 'mean_ms': 1000 * seconds / count} for key, (seconds, count) in totals.items()}
+
+  def summary(self, by_width=False):
+    seconds = getattr(self, 'seconds', time.perf_counter() - self.start)
+    totals = self.totals(by_width)
+    print(f'{"phase":>24} {"seconds":>10} {"% of run":>9} {"count":>8} {"mean ms":>10}')
+    for key, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+      label = f'{key[0]} @ {key[1]}' if by_width else key
+      print(f'{label:>24} {total["seconds"]:10.2f} {100 * total["seconds"] / seconds:8.1f}% {total["count"]:8d} {total["mean_ms"]:10.3f}')
+    return totals
+
+  # Chrome trace event format: one complete ('X') event per span, in microseconds
+  def save_trace(self, path):
+    events = [{'name': name, 'ph': 'X', 'ts': 1e6 * start, 'dur': 1e6 * duration, 'pid': os.getpid(), 'tid': thread,
+               'args': {'width': width, 'epoch_bucket': bucket}} for name, width, bucket, start, duration, thread in self.spans]
+    with open(path, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,63 @@
+"""Correct/wrong prediction (CP/WP) queries over the width sweep.
+
+The analysis cells list the CP and WP folders, parse every filename and
+intersect sets of sample names. A CorrectnessIndex holds the same information
+as a [n_samples, n_widths] correctness bitmap built from the predictions, with
+the CP/WP masks of the width regimes precomputed, so the notebooks' question
+
+    set(CP_2_22) & set(WP_26_69) & set(CP_70_900)
+
+becomes index.query(('CP', 2, 22), ('WP', 26, 69), ('CP', 70, 900)), a few
+boolean operations over the whole test set.
+"""
+
+import numpy as np
+
+# Width ranges of the notebooks: below, around and above the interpolation threshold
+REGIMES = {'2_22': (2, 22), '26_69': (26, 69), '70_900': (70, 900)}
+
+class CorrectnessIndex:
+  # predictions [n_widths, n_samples] (as pred_test_all from the sweeps; -1 marks samples without a prediction)
+  def __init__(self, hidden_variables, predictions, labels, regimes=REGIMES):
+    self.hidden_variables = np.asarray(hidden_variables)
+    predictions = np.asarray(predictions)
+    self.predicted = (predictions >= 0).T
+    self.correct = (predictions == np.asarray(labels)[None, :]).T
+    self.wrong = self.predicted & ~self.correct
+    self._masks = {}
+    for lo, hi in regimes.values():
+      for kind in ('CP', 'WP'):
+        for how in ('any', 'all'):
+          self.mask(kind, lo, hi, how)
+
+  @classmethod
+  def from_store(cls, store, regimes=REGIMES):
+    return cls(store.hidden_variables, store.predictions, store.labels, regimes)
+
+  # Columns of the widths lo <= n_hidden <= hi
+  def widths(self, lo, hi):
+    return (self.hidden_variables >= lo) & (self.hidden_variables <= hi)
+
+  # Samples that are correct (CP) or wrong (WP) at any (like the notebooks' folder scans) or all widths in [lo, hi]
+  def mask(self, kind, lo, hi, how='any'):
+    key = (kind, lo, hi, how)
+    if key not in self._masks:
+      bitmap = {'CP': self.correct, 'WP': self.wrong}[kind][:, self.widths(lo, hi)]
+      self._masks[key] = bitmap.any(1) if how == 'any' else bitmap.all(1) & self.widths(lo, hi).any()
+    return self._masks[key]
+
+  # Boolean mask of the samples satisfying every (kind, lo, hi) condition
+  def query(self, *conditions, how='any'):
+    result = np.ones(len(self.correct), dtype=bool)
+    for kind, lo, hi in conditions:
+      result &= self.mask(kind, lo, hi, how)
+    return result
+
+  # Indices of the samples satisfying every condition
+  def samples(self, *conditions, how='any'):
+    return np.flatnonzero(self.query(*conditions, how=how))
+
+  # Widths at which one sample is correct (CP) or wrong (WP), optionally restricted to [lo, hi]
+  def sample_widths(self, sample, kind, lo=0, hi=np.inf):
+    bitmap = {'CP': self.correct, 'WP': self.wrong}[kind][sample]
+    return self.hidden_variables[bitmap & self.widths(lo, hi)]
@@ -0,0 +1,123 @@
+"""Epoch-wise metrics of the width sweep, recorded to disk while training.
+
+fit_model only prints its statistics every 100 epochs, so epoch-wise double
+descent can't be seen without retraining. A MetricsRecorder keeps the
+train/test loss and error of every width at every scheduled epoch (all
+epochs, or a log-spaced schedule) in one memory-mapped array:
+
+    root/meta.json      hidden_variables, epochs, columns
+    root/metrics.npy    [n_widths, n_epochs, 4] float32, NaN where not recorded
+
+The rows of a width are collected in a small preallocated buffer and handed
+to a background thread every flush_every rows, so training never waits for
+the disk. heatmap(metric) is the [n_widths, n_epochs] width x epoch array.
+"""
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .evaluation import METRICS, Evaluation
+
+# Epochs 0 and n_epoch - 1 and about n_points log-spaced epochs in between
+def log_epochs(n_epoch, n_points=100):
+  return np.unique(np.geomspace(1, n_epoch, n_points).astype(np.int64) - 1)
+
+class MetricsRecorder:
+  # Open an existing recorder, or create it when hidden_variables and epochs are given
+  def __init__(self, root, hidden_variables=None, epochs=None, flush_every=50):
+    self.root = root
+    self.flush_every = flush_every
+    meta_path = os.path.join(root, 'meta.json')
+    if os.path.exists(meta_path):
+      with open(meta_path) as f:
+        meta = json.load(f)
+    else:
+      if hidden_variables is None or epochs is None:
+        raise FileNotFoundError(f'No metrics recorder at {root}; pass hidden_variables and epochs to create one')
+      os.makedirs(root, exist_ok=True)
+      meta = {'hidden_variables': [int(n_hidden) for n_hidden in hidden_variables],
+              'epochs': [int(epoch) for epoch in epochs], 'columns': list(METRICS)}
+      values = np.lib.format.open_memmap(os.path.join(root, 'metrics.npy'), mode='w+', dtype=np.float32,
+                                         shape=(len(meta['hidden_variables']), len(meta['epochs']), len(METRICS)))
+      values[:] = np.nan
+      values.flush()
+      with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+    self.hidden_variables = meta['hidden_variables']
+    self.epochs = np.array(meta['epochs'])
+    self._values = None
+    self._writer = None
+
+  # The memory map and the writer thread are opened on first use in each process,
+  # so a recorder can be passed to the sweep workers
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state['_values'] = None
+    state['_writer'] = None
+    return state
+
+  @property
+  def values(self):
+    if self._values is None:
+      self._values = np.load(os.path.join(self.root, 'metrics.npy'), mmap_mode='r+')
+    return self._values
+
+  def _write(self, c_hidden, rows, metrics):
+    self.values[c_hidden, rows] = metrics
+    self.values.flush()
+
+  # Queue a block of metrics rows of one width for the writer thread
+  def submit(self, c_hidden, rows, metrics):
+    if self._writer is None:
+      self._writer = ThreadPoolExecutor(max_workers=1)
+    return self._writer.submit(self._write, c_hidden, rows, metrics)
+
+  # An Evaluation on the recorder's epochs that records the metrics of the width n_hidden,
+  # e.g. fit_model(model, data, evaluation=recorder.evaluation(n_hidden)) or fit_sweep(..., recorder=recorder)
+  def evaluation(self, n_hidden, **kwargs):
+    return Evaluation(epochs=self.epochs, recorder=WidthRecorder(self, self.hidden_variables.index(int(n_hidden))), **kwargs)
+
+  # [n_widths, n_epochs] values of one metric, e.g. for plt.pcolormesh(recorder.epochs + 1, hidden_variables, heatmap)
+  def heatmap(self, metric='test_error'):
+    return np.asarray(self.values[:, :, METRICS.index(metric)])
+
+class WidthRecorder:
+  def __init__(self, recorder, c_hidden):
+    self.recorder = recorder
+    self.c_hidden = c_hidden
+    self._rows = {int(epoch): row for row, epoch in enumerate(recorder.epochs)}
+    self.buffer = np.empty((recorder.flush_every, len(METRICS)), dtype=np.float32)
+    self.buffer_rows = np.empty(recorder.flush_every, dtype=np.int64)
+    self.n_buffered = 0
+    self.pending = []
+
+  def record(self, epoch, metrics_row):
+    row = self._rows.get(int(epoch))
+    if row is None:
+      return
+    self.buffer[self.n_buffered] = metrics_row
+    self.buffer_rows[self.n_buffered] = row
+    self.n_buffered += 1
+    if self.n_buffered == len(self.buffer):
+      self.flush()
+
+  # Hand the buffered rows to the writer thread; the buffer is reused right away
+  def flush(self):
+    if self.n_buffered:
+      self.pending.append(self.recorder.submit(self.c_hidden, self.buffer_rows[:self.n_buffered].copy(), self.buffer[:self.n_buffered].copy()))
+      self.n_buffered = 0
+    # Raise the errors of finished writes here rather than at the end of training
+    for write in self.pending:
+      if write.done():
+        write.result()
+    self.pending = [write for write in self.pending if not write.done()]
+
+  # Flush and wait until everything recorded is on disk
+  def finish(self):
+    self.flush()
+    for write in self.pending:
+      write.result()
+    self.pending = []
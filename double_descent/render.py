@@ -0,0 +1,154 @@
+"""Deferred, parallel rendering of the attribution scatter plots.
+
+The explainer loops build every figure inline on the global pyplot state and
+encode each one three times (CP/WP and ALL). A RenderService takes attribution
+records off a bounded queue and renders them in a pool of worker processes,
+each with the Agg backend and one figure template whose data is swapped per
+record. Every image is written once, to ALL/; the CP/ and WP/ views are
+symlinks to it, or rows of an index.csv where symlinks aren't available (e.g.
+on Google Drive).
+"""
+
+import os
+import csv
+import time
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from . import profiler
+
+# One plot: the signal x and positions t of a sample, the attributions of its predicted class,
+# its true label and the prediction of the model with n_hidden hidden variables
+PlotRecord = namedtuple('PlotRecord', ['sample', 'n_hidden', 'x', 't', 'values', 'label', 'prediction'])
+
+# File name used by the SHAP notebook
+def plot_name(record):
+  return f'{record.sample}th_smpl_{record.label}{record.prediction}_{record.n_hidden}_nn.jpg'
+
+# The notebooks' scatter plot as a reusable template: (fig, ax, line, points, colorbar)
+def new_template():
+  import matplotlib
+  from matplotlib.figure import Figure
+  fig = Figure()
+  ax = fig.subplots()
+  line, = ax.plot([], [], 'k-', linewidth=2)
+  points = ax.scatter([], [], c=[], cmap=matplotlib.colormaps['bwr'], vmin=0, vmax=1, s=100, alpha=0.7)
+  colorbar = fig.colorbar(points, ax=ax, label='Color intensity')
+  ax.set_title('Scatter Plot with Float Colors')
+  ax.set_xlabel('X Axis')
+  ax.set_ylabel('Y Axis')
+  ax.grid(True)
+  return fig, ax, line, points, colorbar
+
+# Swap the signal x, positions t and attribution values of one sample into a template
+def draw(template, x, t, values):
+  fig, ax, line, points, colorbar = template
+  x, t, values = np.asarray(x), np.asarray(t).ravel(), np.asarray(values)
+  colors = (values/max(values))*256
+  line.set_data(x, t)
+  points.set_offsets(np.column_stack([x, t]))
+  points.set_array(colors)
+  points.set_clim(colors.min(), colors.max())
+  colorbar.update_normal(points)
+  # Scatter collections aren't part of autoscaling, so set the limits with matplotlib's default 5% margins
+  for set_lim, data in ((ax.set_xlim, x), (ax.set_ylim, t)):
+    margin = 0.05 * ((data.max() - data.min()) or 1)
+    set_lim(data.min() - margin, data.max() + margin)
+  return fig
+
+# Figure template of a worker, created once by the pool initializer
+_template = None
+
+def _init_worker():
+  global _template
+  import matplotlib
+  matplotlib.use('Agg')
+  _template = new_template()
+
+def _render(record, path, dpi):
+  draw(_template, record.x, record.t, record.values).savefig(path, format='jpg', dpi=dpi)
+  return path
+
+class RenderService:
+  # views: 'symlink' links CP/ and WP/ to the image in ALL/, 'index' records them in index.csv, None skips them
+  # max_pending bounds the queue of submitted records; submit blocks while it is full
+  def __init__(self, root, n_workers=None, dpi=300, views='symlink', max_pending=256, mp_context='spawn'):
+    self.root = root
+    self.dpi = dpi
+    self.views = views
+    self.max_pending = max_pending
+    for folder in ('ALL', 'CP', 'WP'):
+      os.makedirs(os.path.join(root, folder), exist_ok=True)
+    self.executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(mp_context),
+                                        initializer=_init_worker)
+    self.pending = {}
+    self.n_images = 0
+    self.start = time.perf_counter()
+    self.index = None
+    if views == 'index':
+      index_path = os.path.join(root, 'index.csv')
+      new = not os.path.exists(index_path)
+      self.index_file = open(index_path, 'a', newline='')
+      self.index = csv.writer(self.index_file)
+      if new:
+        self.index.writerow(['sample', 'n_hidden', 'label', 'prediction', 'view', 'path'])
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def submit(self, record):
+    # Time spent waiting for the workers shows up as 'render_wait'; the encoding itself runs in the worker processes
+    with profiler.span('render_wait'):
+      while len(self.pending) >= self.max_pending:
+        self._collect(FIRST_COMPLETED)
+    path = os.path.join(self.root, 'ALL', plot_name(record))
+    self.pending[self.executor.submit(_render, record, path, self.dpi)] = record
+
+  # Queue the plots of a method's attributions in an AttributionStore (all written samples by default)
+  def submit_store(self, store, method, widths=None, samples=None):
+    for n_hidden in (store.hidden_variables if widths is None else widths):
+      written = store.written(method, n_hidden)
+      selected = np.flatnonzero(written) if samples is None else [s for s in samples if written[s]]
+      attributions = store.predicted_attributions(method, n_hidden)
+      c_hidden = store.width_index(n_hidden)
+      for sample in selected:
+        self.submit(PlotRecord(int(sample), int(n_hidden), np.asarray(store.x[sample]), store.t, attributions[sample],
+                               int(store.labels[sample]), int(store.predictions[c_hidden, sample])))
+
+  def _collect(self, return_when):
+    done, not_done = wait(self.pending, return_when=return_when)
+    for future in done:
+      record = self.pending.pop(future)
+      self._add_view(record, future.result())
+      self.n_images += 1
+
+  # The CP/WP view of a rendered image
+  def _add_view(self, record, path):
+    view = 'CP' if record.label == record.prediction else 'WP'
+    if self.views == 'symlink':
+      link = os.path.join(self.root, view, os.path.basename(path))
+      if not os.path.lexists(link):
+        os.symlink(os.path.relpath(path, os.path.dirname(link)), link)
+    elif self.views == 'index':
+      self.index.writerow([record.sample, record.n_hidden, record.label, record.prediction, view, os.path.relpath(path, self.root)])
+
+  # Throughput so far
+  def stats(self):
+    seconds = time.perf_counter() - self.start
+    return {'images': self.n_images, 'seconds': seconds, 'images_per_second': self.n_images / seconds if seconds > 0 else 0.0}
+
+  # Wait for all queued plots and return the throughput
+  def close(self):
+    while self.pending:
+      self._collect(FIRST_COMPLETED)
+    self.executor.shutdown()
+    if self.index is not None:
+      self.index_file.close()
+      self.index = None
+    return self.stats()
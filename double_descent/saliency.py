@@ -0,0 +1,56 @@
+"""Saliency maps for every sample of a split and every class, in a few large batched passes.
+
+The saliency notebook backpropagates the predicted-class logit of one 12-sample
+batch and stops there. Here the input gradients of all 10 logits are computed
+for the whole split with torch.func (vmap over samples of jacrev over classes),
+chunk by chunk, into a preallocated [n_samples, 40, n_classes] array per width.
+"""
+
+import numpy as np
+import torch
+
+from . import profiler
+from .models import D_o
+
+try:
+  from torch.func import jacrev, vmap
+except ImportError:  # torch < 2.0
+  jacrev = vmap = None
+
+# Input gradients of every class for a batch: [batch, 40, n_classes]
+def batch_jacobian(model, x_batch):
+  if vmap is not None:
+    return vmap(jacrev(model))(x_batch).transpose(1, 2)
+  # One backward pass per class; each sample's logit only depends on that sample,
+  # so the gradient of the summed logits is the per-sample gradient
+  x_batch = x_batch.clone().requires_grad_(True)
+  output = model(x_batch)
+  return torch.stack([torch.autograd.grad(output[:, c].sum(), x_batch, retain_graph=True)[0]
+                      for c in range(output.shape[1])], -1)
+
+# |d logit_c / d x_i| (or the signed gradient with absolute=False) for every sample of x, [n, 40, n_classes]
+# out can be a preallocated array (e.g. one slice of sweep_saliency's array) to write into
+def saliency_maps(model, x, batch_size=1000, absolute=True, out=None):
+  model.eval()
+  if out is None:
+    with torch.no_grad():
+      n_classes = model(x[:1]).shape[1]
+    out = np.empty((len(x), x.shape[1], n_classes), dtype=np.float32)
+  with profiler.span('saliency'):
+    for start in range(0, len(x), batch_size):
+      gradients = batch_jacobian(model, x[start:start + batch_size]).detach()
+      out[start:start + batch_size] = (gradients.abs() if absolute else gradients).numpy()
+  return out
+
+# Saliency of the class given per sample (e.g. the predicted class), [n, 40]
+# predictions are indexed with the global sample index, not the index within a batch
+def class_saliency(maps, classes):
+  return maps[np.arange(len(maps)), :, np.asarray(classes)]
+
+# Saliency maps of every width on x, in one preallocated [n_widths, n_samples, 40, n_classes] array
+def sweep_saliency(models, x, batch_size=1000, absolute=True, out=None):
+  if out is None:
+    out = np.empty((len(models), len(x), x.shape[1], D_o), dtype=np.float32)
+  for c_hidden, model in enumerate(models):
+    saliency_maps(model, x, batch_size, absolute, out[c_hidden])
+  return out
@@ -0,0 +1,76 @@
+"""Convergence-aware early stopping for the width sweep.
+
+Every width trains for the full 1000 epochs, although small models plateau
+after a few hundred epochs and large ones reach zero training error long
+before the end. An EarlyStopping ends a run at the first evaluated epoch
+(after min_epochs) where one of its rules holds:
+
+    plateau=(patience, tol)   the best train error improved by less than tol
+                              percentage points over the last patience epochs
+    zero_hold=n               the train error has been 0 for n epochs
+    loss_slope=(window, tol)  the train loss fell by less than tol per epoch,
+                              on average, over the last window epochs
+
+Rules that aren't given are off. The rules see the metrics of the epochs the
+Evaluation schedule evaluates, so they are checked only at those epochs.
+After a run, stop_epoch is the epoch training stopped at (None if it ran the
+full budget) and reason the rule that fired.
+"""
+
+import bisect
+
+class EarlyStopping:
+  def __init__(self, plateau=None, zero_hold=None, loss_slope=None, min_epochs=100):
+    self.plateau = plateau
+    self.zero_hold = zero_hold
+    self.loss_slope = loss_slope
+    self.min_epochs = min_epochs
+    self.start()
+
+  # The rules, as part of the checkpoint key of stopped runs
+  def settings(self):
+    return {'plateau': self.plateau, 'zero_hold': self.zero_hold, 'loss_slope': self.loss_slope, 'min_epochs': self.min_epochs}
+
+  # Forget the history of the previous run
+  def start(self):
+    self.epochs = []
+    self.train_losses = []
+    self.train_errors = []
+    self.zero_since = None
+    self.stop_epoch = None
+    self.reason = None
+
+  # Position in the history of the last evaluated epoch at or before epoch, None if there is none
+  def _before(self, epoch):
+    index = bisect.bisect_right(self.epochs, epoch) - 1
+    return None if index < 0 else index
+
+  # Record the metrics row (train_loss, train_error, ...) of an evaluated epoch and return whether to stop
+  def update(self, epoch, metrics_row):
+    train_loss, train_error = float(metrics_row[0]), float(metrics_row[1])
+    self.epochs.append(epoch)
+    self.train_losses.append(train_loss)
+    self.train_errors.append(train_error)
+    if train_error > 0:
+      self.zero_since = None
+    elif self.zero_since is None:
+      self.zero_since = epoch
+    if epoch + 1 < self.min_epochs:
+      return False
+
+    if self.zero_hold is not None and self.zero_since is not None and epoch - self.zero_since >= self.zero_hold:
+      self.reason = 'zero_hold'
+    if self.reason is None and self.plateau is not None:
+      patience, tol = self.plateau
+      past = self._before(epoch - patience)
+      if past is not None and min(self.train_errors[:past + 1]) - min(self.train_errors[past + 1:]) < tol:
+        self.reason = 'plateau'
+    if self.reason is None and self.loss_slope is not None:
+      window, tol = self.loss_slope
+      past = self._before(epoch - window)
+      if past is not None and (self.train_losses[past] - train_loss) / (epoch - self.epochs[past]) < tol:
+        self.reason = 'loss_slope'
+
+    if self.reason is not None:
+      self.stop_epoch = epoch
+    return self.reason is not None
@@ -0,0 +1,125 @@
+"""Columnar store for attributions, predictions and labels of the width sweep.
+
+The explainer cells keep their results only as 300-dpi JPEGs in CP/, WP/ and
+ALL/. An AttributionStore keeps the numbers instead, as memory-mapped .npy
+arrays indexed by (method, width, sample):
+
+    root/meta.json                hidden_variables, methods, shapes
+    root/x.npy, t.npy, labels.npy the explained signals, sample positions and true labels
+    root/predictions.npy          [n_widths, n_samples] predicted class, -1 where not written
+    root/<method>.npy             [n_widths, n_samples, 40, n_classes] attributions
+    root/<method>_written.npy     [n_widths, n_samples] which attributions were written
+
+Plots are rendered from the store on demand.
+"""
+
+import os
+import json
+
+import numpy as np
+
+from . import profiler
+
+class AttributionStore:
+  # Open an existing store, or create it when hidden_variables, x, t and labels are given
+  def __init__(self, root, hidden_variables=None, x=None, t=None, labels=None, n_classes=10):
+    self.root = root
+    meta_path = os.path.join(root, 'meta.json')
+    if os.path.exists(meta_path):
+      with open(meta_path) as f:
+        self.meta = json.load(f)
+    else:
+      if hidden_variables is None or x is None or t is None or labels is None:
+        raise FileNotFoundError(f'No attribution store at {root}; pass hidden_variables, x, t and labels to create one')
+      os.makedirs(root, exist_ok=True)
+      self.meta = {'hidden_variables': [int(n_hidden) for n_hidden in hidden_variables], 'n_samples': len(x),
+                   'n_features': int(np.shape(x)[1]), 'n_classes': n_classes, 'methods': []}
+      np.save(os.path.join(root, 'x.npy'), np.asarray(x, dtype=np.float32))
+      np.save(os.path.join(root, 't.npy'), np.asarray(t, dtype=np.float32).ravel())
+      np.save(os.path.join(root, 'labels.npy'), np.asarray(labels, dtype=np.int64))
+      predictions = np.lib.format.open_memmap(os.path.join(root, 'predictions.npy'), mode='w+', dtype=np.int64,
+                                              shape=(len(self.meta['hidden_variables']), len(x)))
+      predictions[:] = -1
+      predictions.flush()
+      self._save_meta()
+    self.hidden_variables = self.meta['hidden_variables']
+    self.x = np.load(os.path.join(root, 'x.npy'), mmap_mode='r')
+    self.t = np.load(os.path.join(root, 't.npy'))
+    self.labels = np.load(os.path.join(root, 'labels.npy'), mmap_mode='r')
+    self.predictions = np.load(os.path.join(root, 'predictions.npy'), mmap_mode='r+')
+    self._arrays = {}
+
+  def _save_meta(self):
+    with open(os.path.join(self.root, 'meta.json'), 'w') as f:
+      json.dump(self.meta, f, indent=1)
+
+  @property
+  def methods(self):
+    return list(self.meta['methods'])
+
+  # Position of a width in hidden_variables
+  def width_index(self, n_hidden):
+    return self.hidden_variables.index(int(n_hidden))
+
+  # The memory-mapped attribution and written-mask arrays of a method, created on first use
+  def _method_arrays(self, method):
+    if method not in self._arrays:
+      path = os.path.join(self.root, method + '.npy')
+      written_path = os.path.join(self.root, method + '_written.npy')
+      if method not in self.meta['methods']:
+        shape = (len(self.hidden_variables), self.meta['n_samples'], self.meta['n_features'], self.meta['n_classes'])
+        np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape).flush()
+        np.lib.format.open_memmap(written_path, mode='w+', dtype=np.bool_, shape=shape[:2]).flush()
+        self.meta['methods'].append(method)
+        self._save_meta()
+      self._arrays[method] = (np.load(path, mmap_mode='r+'), np.load(written_path, mmap_mode='r+'))
+    return self._arrays[method]
+
+  # Store the attributions [n, 40, n_classes] of the given samples (all samples by default) for one width
+  def write(self, method, n_hidden, attributions, samples=None):
+    values, written = self._method_arrays(method)
+    samples = slice(None) if samples is None else np.asarray(samples)
+    values[self.width_index(n_hidden), samples] = attributions
+    written[self.width_index(n_hidden), samples] = True
+
+  def write_predictions(self, n_hidden, predictions, samples=None):
+    samples = slice(None) if samples is None else np.asarray(samples)
+    self.predictions[self.width_index(n_hidden), samples] = np.asarray(predictions)
+
+  def flush(self):
+    self.predictions.flush()
+    for values, written in self._arrays.values():
+      values.flush()
+      written.flush()
+
+  # Attributions of a method, for one width (or all) and some samples (or all): [..., 40, n_classes]
+  def attributions(self, method, n_hidden=None, samples=None):
+    values, written = self._method_arrays(method)
+    values = values if n_hidden is None else values[self.width_index(n_hidden)]
+    return values if samples is None else values[..., np.asarray(samples), :, :]
+
+  def written(self, method, n_hidden=None):
+    values, written = self._method_arrays(method)
+    return written if n_hidden is None else written[self.width_index(n_hidden)]
+
+  # Attributions of the predicted class of every sample for one width, [n_samples, 40]
+  def predicted_attributions(self, method, n_hidden):
+    predictions = np.asarray(self.predictions[self.width_index(n_hidden)])
+    return np.asarray(self.attributions(method, n_hidden))[np.arange(len(predictions)), :, predictions]
+
+  # Correct predictions (the CP folder) of one width, or [n_widths, n_samples] for all widths
+  def correct(self, n_hidden=None):
+    predictions = self.predictions if n_hidden is None else self.predictions[self.width_index(n_hidden)]
+    return np.asarray(predictions) == np.asarray(self.labels)
+
+  # The notebooks' scatter plot of a sample's predicted-class attributions, rendered from the store
+  # Written to path when given; returns the figure (render.RenderService renders many records in parallel)
+  def render(self, method, n_hidden, sample, path=None, dpi=300):
+    from .render import new_template, draw
+    k_val = int(self.predictions[self.width_index(n_hidden), sample])
+    val = self.attributions(method, n_hidden)[sample, :, k_val]
+    fig = draw(new_template(), self.x[sample], self.t, val)
+    if path is not None:
+      with profiler.span('savefig'):
+        fig.savefig(path, format=os.path.splitext(path)[1][1:] or 'jpg', dpi=dpi)
+    return fig
@@ -0,0 +1,205 @@
+"""Run the hidden width sweep, either serially or spread over a process pool, optionally crossed with training-set sizes."""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+
+from . import profiler
+from .checkpoint import CheckpointStore
+from .models import get_model, fit_model
+from .data import nested_subsets, subset
+
+# Train one width and return its errors, predictions and trained model
+# With a seed, the initialization and the batch order of that width are reproducible on their own,
+# so the serial and the parallel sweep give the same results
+# With a CheckpointStore, finished widths are loaded instead of retrained and unfinished ones are resumed
+# With a MetricsRecorder, the metrics of every epoch on its schedule are recorded for the width
+# With an EarlyStopping, training ends when its rules hold and stopping.stop_epoch says when
+# fit_kwargs are passed on to fit_model (e.g. loader='tensor')
+def fit_width(n_hidden, data, seed=None, checkpoints=None, recorder=None, stopping=None, n_epoch=1000, **fit_kwargs):
+  checkpoint = None if checkpoints is None else checkpoints.width(n_hidden, seed, stopping, n_epoch)
+  if checkpoint is not None and checkpoint.done:
+    print(f'Loading finished model with {int(n_hidden):3d} hidden variables from {checkpoint.path}')
+    if stopping is not None:
+      stopping.start()
+      stopping.stop_epoch = checkpoint.stop_epoch
+    errors_train, errors_test, pred_train, pred_test = checkpoint.results
+    return float(errors_train), float(errors_test), pred_train.numpy(), pred_test.numpy(), checkpoint.load_model(get_model(int(n_hidden)))
+  if seed is not None:
+    torch.manual_seed(seed)
+  if recorder is not None:
+    fit_kwargs['evaluation'] = recorder.evaluation(n_hidden)
+  model = get_model(int(n_hidden))
+  with profiler.width(n_hidden):
+    errors_train, errors_test, pred_train, pred_test = fit_model(model, data, checkpoint, stopping=stopping, n_epoch=n_epoch, **fit_kwargs)
+  return float(errors_train), float(errors_test), pred_train.numpy(), pred_test.numpy(), model
+
+# Seed of width c_hidden, derived from the seed of the sweep
+def width_seed(seed, c_hidden):
+  return None if seed is None else seed + c_hidden
+
+# Allocate the arrays the sweep cells fill in
+def empty_results(hidden_variables, data):
+  errors_train_all = np.zeros(len(hidden_variables))
+  errors_test_all = np.zeros(len(hidden_variables))
+  pred_train_all = np.zeros((len(hidden_variables), len(data['y'])), dtype=np.int64)
+  pred_test_all = np.zeros((len(hidden_variables), len(data['y_test'])), dtype=np.int64)
+  return errors_train_all, errors_test_all, pred_train_all, pred_test_all
+
+# The %%time sweep cell of the notebooks
+def fit_sweep(hidden_variables, data, seed=None, checkpoints=None, **fit_kwargs):
+  errors_train_all, errors_test_all, pred_train_all, pred_test_all = empty_results(hidden_variables, data)
+  models = [None] * len(hidden_variables)
+
+  for c_hidden in range(len(hidden_variables)):
+    print("#"*100)
+    print(f'Training model with {hidden_variables[c_hidden]:3d} hidden variables')
+    errors_train_all[c_hidden], errors_test_all[c_hidden], pred_train_all[c_hidden], pred_test_all[c_hidden], models[c_hidden] = \
+      fit_width(hidden_variables[c_hidden], data, width_seed(seed, c_hidden), checkpoints, **fit_kwargs)
+
+  return errors_train_all, errors_test_all, pred_train_all, pred_test_all, models
+
+# fit_sweep with early stopping: every width is trained with the stopping rules, then (with refine) the stopped
+# widths within a factor window of the test-error peak are continued from where they stopped to the full n_epoch
+# budget, so the interpolation peak of the curve isn't distorted. Stopping only truncates a run, so the continued
+# run is the same as one trained without stopping.
+# Without a CheckpointStore, the stopped states are kept in memory for the continuation
+# Returns the fit_sweep results, the number of epochs each width was trained for over both passes, and the
+# epoch each width stopped at in the first pass (stopping.stop_epoch, -1 where it ran the full budget), which
+# stays recorded for the widths the refine pass continued
+def fit_sweep_adaptive(hidden_variables, data, stopping, window=2.0, refine=True, seed=None, checkpoints=None, n_epoch=1000, **fit_kwargs):
+  errors_train_all, errors_test_all, pred_train_all, pred_test_all = empty_results(hidden_variables, data)
+  models = [None] * len(hidden_variables)
+  epochs_all = np.zeros(len(hidden_variables), dtype=np.int64)
+  if checkpoints is None:
+    checkpoints = CheckpointStore(None, {}, None, every=n_epoch)
+
+  def fit(c_hidden, stopping):
+    print("#"*100)
+    print(f'Training model with {hidden_variables[c_hidden]:3d} hidden variables')
+    errors_train_all[c_hidden], errors_test_all[c_hidden], pred_train_all[c_hidden], pred_test_all[c_hidden], models[c_hidden] = \
+      fit_width(hidden_variables[c_hidden], data, width_seed(seed, c_hidden), checkpoints, stopping=stopping, n_epoch=n_epoch, **fit_kwargs)
+    stopped = stopping is not None and stopping.stop_epoch is not None
+    return stopping.stop_epoch + 1 if stopped else None
+
+  stop_epochs = [fit(c_hidden, stopping) for c_hidden in range(len(hidden_variables))]
+  epochs_all[:] = [n_epoch if epochs is None else epochs for epochs in stop_epochs]
+  stop_epochs_all = np.array([-1 if epochs is None else epochs - 1 for epochs in stop_epochs], dtype=np.int64)
+  if refine:
+    peak = hidden_variables[int(np.argmax(errors_test_all))]
+    for c_hidden in range(len(hidden_variables)):
+      if stop_epochs[c_hidden] is not None and peak / window <= hidden_variables[c_hidden] <= peak * window:
+        print(f'Width {hidden_variables[c_hidden]:3d} is near the test-error peak at {peak:3d}, continuing it to the full budget')
+        c_seed = width_seed(seed, c_hidden)
+        full = checkpoints.width(hidden_variables[c_hidden], c_seed, n_epoch=n_epoch)
+        if not full.done and (full.state is None or full.state['epoch'] < stop_epochs[c_hidden]):
+          full.continue_from(checkpoints.width(hidden_variables[c_hidden], c_seed, stopping, n_epoch))
+        fit(c_hidden, None)
+        epochs_all[c_hidden] += n_epoch - stop_epochs[c_hidden]
+
+  print(f'Trained {epochs_all.sum()} of {n_epoch * len(hidden_variables)} width epochs')
+  return errors_train_all, errors_test_all, pred_train_all, pred_test_all, models, epochs_all, stop_epochs_all
+
+# Data shared by all jobs of a worker, set once by the pool initializer instead of pickled per job
+_worker_data = None
+
+_worker_checkpoints = None
+_worker_fit_kwargs = {}
+
+# Training indices of each size of a size sweep, and the subsets a worker has gathered so far
+_worker_subsets = None
+_worker_subset_data = {}
+
+def _init_worker(data, threads_per_worker, checkpoints, fit_kwargs, subsets=None):
+  global _worker_data, _worker_checkpoints, _worker_fit_kwargs, _worker_subsets
+  _worker_data = data() if callable(data) else data
+  _worker_checkpoints = checkpoints
+  _worker_fit_kwargs = fit_kwargs
+  _worker_subsets = subsets
+  # Pin intra-op threads so the workers don't oversubscribe the cores
+  torch.set_num_threads(threads_per_worker)
+  try:
+    torch.set_num_interop_threads(1)
+  except RuntimeError:
+    # Forked workers inherit a started inter-op pool, which can't be resized any more
+    pass
+
+def _fit_width_job(c_hidden, n_hidden, seed):
+  errors_train, errors_test, pred_train, pred_test, model = fit_width(n_hidden, _worker_data, seed, _worker_checkpoints, **_worker_fit_kwargs)
+  return c_hidden, errors_train, errors_test, pred_train, pred_test, model.state_dict()
+
+# Same results as fit_sweep, with the widths spread over a pool of n_workers processes
+# Jobs are submitted largest width first, so the long jobs don't end up alone at the end of the sweep
+# data is the dataset dictionary, or a picklable function returning it, e.g.
+# functools.partial(data.load_dataset, args, cache_dir), so each worker maps the cached copy instead of
+# receiving a pickled one
+def fit_sweep_parallel(hidden_variables, data, n_workers=None, threads_per_worker=1, seed=None, mp_context='spawn', checkpoints=None, **fit_kwargs):
+  if n_workers is None:
+    n_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+  load_data = data
+  data = data() if callable(data) else data
+  errors_train_all, errors_test_all, pred_train_all, pred_test_all = empty_results(hidden_variables, data)
+  models = [None] * len(hidden_variables)
+
+  order = np.argsort(-np.asarray(hidden_variables), kind='stable')
+  with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(mp_context),
+                           initializer=_init_worker, initargs=(load_data, threads_per_worker, checkpoints, fit_kwargs)) as executor:
+    jobs = [executor.submit(_fit_width_job, int(c_hidden), int(hidden_variables[c_hidden]), width_seed(seed, int(c_hidden)))
+            for c_hidden in order]
+    for job in as_completed(jobs):
+      c_hidden, errors_train, errors_test, pred_train, pred_test, state_dict = job.result()
+      errors_train_all[c_hidden] = errors_train
+      errors_test_all[c_hidden] = errors_test
+      pred_train_all[c_hidden] = pred_train
+      pred_test_all[c_hidden] = pred_test
+      models[c_hidden] = get_model(int(hidden_variables[c_hidden]))
+      models[c_hidden].load_state_dict(state_dict)
+      print(f'Finished model with {hidden_variables[c_hidden]:3d} hidden variables, train error {errors_train:3.2f}, test error {errors_test:3.2f}')
+
+  return errors_train_all, errors_test_all, pred_train_all, pred_test_all, models
+
+# Training data of size c_size of a size sweep, gathered from the master dataset once per worker
+def _size_data(c_size):
+  if c_size not in _worker_subset_data:
+    _worker_subset_data[c_size] = subset(_worker_data, _worker_subsets[c_size])
+  return _worker_subset_data[c_size]
+
+def _fit_size_job(c_size, c_hidden, n_hidden, seed):
+  errors_train, errors_test, pred_train, pred_test, model = fit_width(n_hidden, _size_data(c_size), seed, **_worker_fit_kwargs)
+  return c_size, c_hidden, errors_train, errors_test, pred_test
+
+# Sample-wise double descent: every width of hidden_variables trained on every training-set size of train_sizes,
+# on the same process pool as fit_sweep_parallel
+# The sizes are nested subsets of the master training set (see data.nested_subsets, drawn with subset_seed),
+# so a smaller set is always part of a larger one and its label noise is the same
+# Each worker loads the master dataset once and gathers each subset once; a width gets the same seed,
+# and so the same initialization, at every size
+# Returns the [n_sizes, n_widths] train and test error surfaces and the [n_sizes, n_widths, n_test] test predictions
+def fit_size_sweep(hidden_variables, train_sizes, data, n_workers=None, threads_per_worker=1, seed=None, subset_seed=0, mp_context='spawn', **fit_kwargs):
+  if n_workers is None:
+    n_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+  load_data = data
+  data = data() if callable(data) else data
+  subsets = nested_subsets(len(data['y']), train_sizes, subset_seed)
+  errors_train_surface = np.zeros((len(train_sizes), len(hidden_variables)))
+  errors_test_surface = np.zeros((len(train_sizes), len(hidden_variables)))
+  pred_test_surface = np.zeros((len(train_sizes), len(hidden_variables), len(data['y_test'])), dtype=np.int64)
+
+  # Largest jobs first, by the cost of an epoch: training samples times weights
+  cells = [(c_size, c_hidden) for c_size in range(len(train_sizes)) for c_hidden in range(len(hidden_variables))]
+  cost = lambda cell: train_sizes[cell[0]] * hidden_variables[cell[1]] * (hidden_variables[cell[1]] + 50)
+  with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(mp_context),
+                           initializer=_init_worker, initargs=(load_data, threads_per_worker, None, fit_kwargs, subsets)) as executor:
+    jobs = [executor.submit(_fit_size_job, c_size, c_hidden, int(hidden_variables[c_hidden]), width_seed(seed, c_hidden))
+            for c_size, c_hidden in sorted(cells, key=cost, reverse=True)]
+    for job in as_completed(jobs):
+      c_size, c_hidden, errors_train, errors_test, pred_test = job.result()
+      errors_train_surface[c_size, c_hidden] = errors_train
+      errors_test_surface[c_size, c_hidden] = errors_test
+      pred_test_surface[c_size, c_hidden] = pred_test
+      print(f'Finished model with {hidden_variables[c_hidden]:3d} hidden variables on {train_sizes[c_size]:5d} samples, train error {errors_train:3.2f}, test error {errors_test:3.2f}')
+
+  return errors_train_surface, errors_test_surface, pred_test_surface
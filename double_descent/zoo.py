@@ -0,0 +1,184 @@
+"""Train a whole ladder of widths together as one batched "model zoo".
+
+Every width of the get_model MLP is zero-padded up to the largest width in its
+bucket and the weights of all models are stacked into [n_models, ...] tensors,
+so one torch.baddbmm per layer runs the forward pass of every model on a shared
+batch and one optimizer step updates all of them.
+
+Padded units need no explicit mask: their weights start at zero, ReLU passes a
+zero gradient at zero, so the padded weights receive exactly zero gradient and
+SGD (with momentum, without weight decay) keeps them at zero for the whole run.
+
+The same zoo holds several independently initialized copies of each width, so
+fit_seed_ensemble trains a seed ensemble of the sweep in the same pass and
+reports the mean error curve with confidence bands.
+"""
+
+import numpy as np
+import torch, torch.nn as nn
+from torch.utils.data import TensorDataset, DataLoader
+
+from .models import D_i, D_o, get_model, get_tensors
+
+# Group the widths into buckets whose largest width is at most max_ratio times the smallest,
+# so padding wastes a bounded amount of compute. max_ratio=None puts everything in one bucket.
+def width_buckets(hidden_variables, max_ratio=1.5):
+  order = np.argsort(hidden_variables, kind='stable')
+  buckets = []
+  for c_hidden in order:
+    n_hidden = int(hidden_variables[c_hidden])
+    if buckets and (max_ratio is None or n_hidden <= max_ratio * int(hidden_variables[buckets[-1][0]])):
+      buckets[-1].append(int(c_hidden))
+    else:
+      buckets.append([int(c_hidden)])
+  return buckets
+
+class ModelZoo(nn.Module):
+  def __init__(self, widths):
+    super().__init__()
+    self.widths = [int(n_hidden) for n_hidden in widths]
+    n_models = len(self.widths)
+    D_k = max(self.widths)
+    self.w1 = nn.Parameter(torch.zeros(n_models, D_k, D_i))
+    self.b1 = nn.Parameter(torch.zeros(n_models, D_k))
+    self.w2 = nn.Parameter(torch.zeros(n_models, D_k, D_k))
+    self.b2 = nn.Parameter(torch.zeros(n_models, D_k))
+    self.w3 = nn.Parameter(torch.zeros(n_models, D_o, D_k))
+    self.b3 = nn.Parameter(torch.zeros(n_models, D_o))
+
+  # Build a zoo from get_model networks, copying their initial weights into the padded slots
+  @classmethod
+  def from_models(cls, models):
+    widths = [model[0].out_features for model in models]
+    zoo = cls(widths)
+    with torch.no_grad():
+      for c_model, (model, n_hidden) in enumerate(zip(models, widths)):
+        zoo.w1[c_model, :n_hidden] = model[0].weight
+        zoo.b1[c_model, :n_hidden] = model[0].bias
+        zoo.w2[c_model, :n_hidden, :n_hidden] = model[2].weight
+        zoo.b2[c_model, :n_hidden] = model[2].bias
+        zoo.w3[c_model, :, :n_hidden] = model[4].weight
+        zoo.b3[c_model] = model[4].bias
+    return zoo
+
+  # Return model c_model as a standalone get_model network (e.g. for the explainers)
+  def export(self, c_model):
+    n_hidden = self.widths[c_model]
+    model = get_model(n_hidden)
+    with torch.no_grad():
+      model[0].weight.copy_(self.w1[c_model, :n_hidden])
+      model[0].bias.copy_(self.b1[c_model, :n_hidden])
+      model[2].weight.copy_(self.w2[c_model, :n_hidden, :n_hidden])
+      model[2].bias.copy_(self.b2[c_model, :n_hidden])
+      model[4].weight.copy_(self.w3[c_model, :, :n_hidden])
+      model[4].bias.copy_(self.b3[c_model])
+    return model
+
+  # x is either one batch shared by all models [batch, D_i] or one batch per model [n_models, batch, D_i]
+  # Returns the logits of every model, [n_models, batch, D_o]
+  def forward(self, x):
+    if x.dim() == 2:
+      x = x.unsqueeze(0).expand(len(self.widths), -1, -1)
+    h = torch.relu(torch.baddbmm(self.b1.unsqueeze(1), x, self.w1.transpose(1, 2)))
+    h = torch.relu(torch.baddbmm(self.b2.unsqueeze(1), h, self.w2.transpose(1, 2)))
+    return torch.baddbmm(self.b3.unsqueeze(1), h, self.w3.transpose(1, 2))
+
+# Errors (in percent), losses and predicted classes of every model in the zoo on one split
+def zoo_statistics(zoo, x, y):
+  with torch.no_grad():
+    pred = zoo(x)
+  n_models = pred.shape[0]
+  _, predicted_class = torch.max(pred, 2)
+  errors = 100 - 100 * (predicted_class == y).float().sum(1) / len(y)
+  losses = nn.functional.cross_entropy(pred.transpose(1, 2), y.expand(n_models, -1), reduction='none').mean(1)
+  return errors, losses, predicted_class
+
+# Train every model of the zoo with the same recipe as fit_model, sharing each batch between the models
+def fit_zoo(zoo, data, n_epoch=1000, batch_size=100):
+
+  # Summing the per-model mean losses gives every model exactly its own gradient
+  loss_function = torch.nn.CrossEntropyLoss(reduction='sum')
+  optimizer = torch.optim.SGD(zoo.parameters(), lr = 0.01, momentum=0.9)
+
+  x_train, y_train, x_test, y_test = get_tensors(data)
+  data_loader = DataLoader(TensorDataset(x_train,y_train), batch_size=batch_size, shuffle=True)
+  n_models = len(zoo.widths)
+
+  for epoch in range(n_epoch):
+    for x_batch, y_batch in data_loader:
+      optimizer.zero_grad()
+      pred = zoo(x_batch)
+      loss = loss_function(pred.reshape(-1, D_o), y_batch.repeat(n_models)) / len(y_batch)
+      loss.backward()
+      optimizer.step()
+
+    # Only the printed epochs and the final one need the full-dataset statistics
+    if epoch%100 ==0 or epoch == n_epoch - 1:
+      errors_train, losses_train, predicted_train_class = zoo_statistics(zoo, x_train, y_train)
+      errors_test, losses_test, predicted_test_class = zoo_statistics(zoo, x_test, y_test)
+    if epoch%100 ==0 :
+      for c_model, n_hidden in enumerate(zoo.widths):
+        print(f'Epoch {epoch:5d}, width {n_hidden:3d}, train loss {losses_train[c_model]:.6f}, train error {errors_train[c_model]:3.2f},  test loss {losses_test[c_model]:.6f}, test error {errors_test[c_model]:3.2f}')
+
+  return errors_train, errors_test, predicted_train_class, predicted_test_class
+
+# Mean and two-sided confidence band (Student t over the seeds) of errors [n_widths, n_seeds]
+# Returns mean, low and high, each [n_widths]
+def confidence_band(errors, confidence=0.95):
+  import scipy.stats
+  errors = np.asarray(errors, dtype=np.float64)
+  n_seeds = errors.shape[1]
+  mean = errors.mean(1)
+  if n_seeds < 2:
+    return mean, mean.copy(), mean.copy()
+  half_width = scipy.stats.t.ppf((1 + confidence) / 2, n_seeds - 1) * errors.std(1, ddof=1) / np.sqrt(n_seeds)
+  return mean, mean - half_width, mean + half_width
+
+# The sweep with n_seeds independently initialized copies of every width, all copies of the widths in a bucket
+# trained together as one zoo on the same batches
+# Copy s of width c_hidden is initialized after torch.manual_seed(seed + c_hidden + s * len(hidden_variables)),
+# so copy 0 starts from the same weights as fit_sweep(..., seed=seed)
+# Returns the [n_widths, n_seeds] train and test errors and {'train': (mean, low, high), 'test': (mean, low, high)}
+def fit_seed_ensemble(hidden_variables, data, n_seeds=5, seed=0, max_ratio=1.5, n_epoch=1000, batch_size=100, confidence=0.95):
+  errors_train_all = np.zeros((len(hidden_variables), n_seeds))
+  errors_test_all = np.zeros((len(hidden_variables), n_seeds))
+
+  for bucket in width_buckets(hidden_variables, max_ratio):
+    print("#"*100)
+    print(f'Training {n_seeds} seeds of the models with {[int(hidden_variables[c_hidden]) for c_hidden in bucket]} hidden variables')
+    members = [(c_hidden, c_seed) for c_hidden in bucket for c_seed in range(n_seeds)]
+    models = []
+    for c_hidden, c_seed in members:
+      torch.manual_seed(seed + c_hidden + c_seed * len(hidden_variables))
+      models.append(get_model(int(hidden_variables[c_hidden])))
+    zoo = ModelZoo.from_models(models)
+    errors_train, errors_test, pred_train, pred_test = fit_zoo(zoo, data, n_epoch, batch_size)
+    for c_model, (c_hidden, c_seed) in enumerate(members):
+      errors_train_all[c_hidden, c_seed] = errors_train[c_model]
+      errors_test_all[c_hidden, c_seed] = errors_test[c_model]
+
+  bands = {'train': confidence_band(errors_train_all, confidence), 'test': confidence_band(errors_test_all, confidence)}
+  return errors_train_all, errors_test_all, bands
+
+# Drop-in replacement for the %%time sweep cell: trains all widths bucket by bucket and
+# returns errors_train_all, errors_test_all, the per-width train/test predictions and the trained models
+def fit_sweep_zoo(hidden_variables, data, max_ratio=1.5, n_epoch=1000, batch_size=100):
+  errors_train_all = np.zeros(len(hidden_variables))
+  errors_test_all = np.zeros(len(hidden_variables))
+  pred_train_all = np.zeros((len(hidden_variables), len(data['y'])), dtype=np.int64)
+  pred_test_all = np.zeros((len(hidden_variables), len(data['y_test'])), dtype=np.int64)
+  models = [None] * len(hidden_variables)
+
+  for bucket in width_buckets(hidden_variables, max_ratio):
+    print("#"*100)
+    print(f'Training models with {[int(hidden_variables[c_hidden]) for c_hidden in bucket]} hidden variables')
+    zoo = ModelZoo.from_models([get_model(int(hidden_variables[c_hidden])) for c_hidden in bucket])
+    errors_train, errors_test, pred_train, pred_test = fit_zoo(zoo, data, n_epoch, batch_size)
+    for c_model, c_hidden in enumerate(bucket):
+      errors_train_all[c_hidden] = errors_train[c_model]
+      errors_test_all[c_hidden] = errors_test[c_model]
+      pred_train_all[c_hidden] = pred_train[c_model].numpy()
+      pred_test_all[c_hidden] = pred_test[c_model].numpy()
+      models[c_hidden] = zoo.export(c_model)
+
+  return errors_train_all, errors_test_all, pred_train_all, pred_test_all, models
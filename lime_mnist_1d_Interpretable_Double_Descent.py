@@ -21,6 +21,14 @@ drive.mount('/content/drive')
 # Run this if you're in a Colab to make a local copy of the MNIST 1D repository
 !git clone https://github.com/greydanus/mnist1d
 
+# The cells below use the double_descent package of this repository. In a Colab, keep a copy of the repository
+# on Drive and put it on the path; run from a checkout of the repository it is importable already
+import os, sys
+DOUBLE_DESCENT_ROOT = '/content/drive/MyDrive/interpretable_double_descent'
+if os.path.isdir(os.path.join(DOUBLE_DESCENT_ROOT, 'double_descent')):
+  sys.path.insert(0, DOUBLE_DESCENT_ROOT)
+import double_descent
+
 !pip install shap
 
 import torch, torch.nn as nn
@@ -53,14 +61,13 @@ args.num_samples = 8000 # try after changing this
 args.train_split = 0.5 # try after changing this
 args.corr_noise_scale = 0.25 # try after changing this
 args.iid_noise_scale = 2e-2 # try after changing this
-data = mnist1d.data.get_dataset(args, path='./mnist1d_data.pkl', download=False, regenerate=True)
-
-# Add 15% noise to training labels
-for c_y in range(len(data['y'])):
-    random_number = random.random()
-    if random_number < 0.15 :
-        random_int = int(random.random() * 10)
-        data['y'][c_y] = random_int
+# Generated once per set of arguments, then memory-mapped from the cache
+from double_descent.data import get_dataset_cached
+data = get_dataset_cached(args, cache_dir='./mnist1d_cache')
+
+# Add 15% noise to training labels, keeping track of which labels were corrupted
+from double_descent.data import add_label_noise
+data['y'], data['noise_mask'] = add_label_noise(data['y'], 0.15, rng=np.random.default_rng(0))
 
 # The training and test input and outputs are in
 # data['x'], data['y'], data['x_test'], and data['y_test']
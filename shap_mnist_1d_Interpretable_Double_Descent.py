@@ -21,6 +21,14 @@ drive.mount('/content/drive')
 # Run this if you're in a Colab to make a local copy of the MNIST 1D repository
 !git clone https://github.com/greydanus/mnist1d
 
+# The cells below use the double_descent package of this repository. In a Colab, keep a copy of the repository
+# on Drive and put it on the path; run from a checkout of the repository it is importable already
+import os, sys
+DOUBLE_DESCENT_ROOT = '/content/drive/MyDrive/interpretable_double_descent'
+if os.path.isdir(os.path.join(DOUBLE_DESCENT_ROOT, 'double_descent')):
+  sys.path.insert(0, DOUBLE_DESCENT_ROOT)
+import double_descent
+
 !pip install shap
 
 import torch, torch.nn as nn
@@ -53,14 +61,13 @@ args.num_samples = 8000 # try after changing this
 args.train_split = 0.5 # try after changing this
 args.corr_noise_scale = 0.25 # try after changing this
 args.iid_noise_scale = 2e-2 # try after changing this
-data = mnist1d.data.get_dataset(args, path='./mnist1d_data.pkl', download=False, regenerate=True)
+# Generated once per set of arguments, then memory-mapped from the cache
+from double_descent.data import get_dataset_cached
+data = get_dataset_cached(args, cache_dir='./mnist1d_cache')
 
-# Add 15% noise to training labels
-for c_y in range(len(data['y'])):
-    random_number = random.random()
-    if random_number < 0.15 :
-        random_int = int(random.random() * 10)
-        data['y'][c_y] = random_int
+# Add 15% noise to training labels, keeping track of which labels were corrupted
+from double_descent.data import add_label_noise
+data['y'], data['noise_mask'] = add_label_noise(data['y'], 0.15, rng=np.random.default_rng(0))
 
 # The training and test input and outputs are in
 # data['x'], data['y'], data['x_test'], and data['y_test']
@@ -170,8 +177,11 @@ def fit_model(model, data):
 #for c_hidden in range(25,len(hidden_variables)):
 #    print(hidden_variables[c_hidden])
 
-for c_hidden in range(28,len(hidden_variables)):
-    print(hidden_variables[c_hidden])
+# Finished and partially trained widths are checkpointed, so a rerun of the sweep below
+# skips or resumes them instead of editing the range of the loop by hand
+from double_descent.checkpoint import CheckpointStore
+from double_descent.sweep import fit_width
+checkpoints = CheckpointStore('/content/drive/MyDrive/MNIST_results_v2/checkpoints', args, noise_rate=0.15)
 
 len([2,4,6,8,10,14,18,22,26,30,35,40,45,50,55,60,70,80,90,100,120,140,160,180,200,250,300,400, 500, 600, 700, 800, 900])
 
@@ -182,13 +192,11 @@ len([2,4,6,8,10,14,18,22,26,30,35,40,45,50,55,60,70,80,90,100,120,140,160,180,20
 # errors_test_all = np.zeros_like(hidden_variables)
 # 
 # # For each hidden variable size
-# for c_hidden in range(28,len(hidden_variables)):
+# for c_hidden in range(len(hidden_variables)):
 #     print("#"*100)
 #     print(f'Training model with {hidden_variables[c_hidden]:3d} hidden variables')
-#     # Get a model
-#     model = get_model(hidden_variables[c_hidden]) ;
-#     # Train the model
-#     errors_train, errors_test, pred_train, pred_test = fit_model(model, data)
+#     # Get a trained model (loaded or resumed from its checkpoint if there is one)
+#     errors_train, errors_test, pred_train, pred_test, model = fit_width(hidden_variables[c_hidden], data, seed=c_hidden, checkpoints=checkpoints)
 #     # Store the results
 #     errors_train_all[c_hidden] = errors_train
 #     errors_test_all[c_hidden]= errors_test